@@ -36,6 +36,12 @@ if %errorlevel% neq 0 (
     echo py -m pip install -r requirements.txt
     echo.
 ) else (
+    echo.
+    echo Downloading the user interface libraries for offline use...
+    py fetch_assets.py
+    if errorlevel 1 (
+        echo [WARNING] Could not download the interface libraries. The page will load them from the internet instead.
+    )
     echo.
     echo ===================================================
     echo      Installation Successful!
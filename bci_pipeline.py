@@ -0,0 +1,1157 @@
+import os
+import time
+import threading
+import queue
+import json
+import re
+import ast
+import warnings
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+from brainflow.data_filter import DataFilter
+
+# Signal processing, montages, metrics, decisions and recording: everything
+# that does not need the web server, a board or a keyboard. benchmark.py,
+# replay.py and the feature worker process import this module on its own.
+
+# --- Profiling ---
+# Per-stage timers for the data thread. Durations go into log2 histograms
+# (bucket b counts durations below 2**b microseconds), so recording is a
+# couple of integer ops; when disabled, mark/record return immediately.
+class StageTimers:
+    NUM_BUCKETS = 24
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.totals = {}
+            self.maxima = {}
+
+    def mark(self):
+        return time.perf_counter() if self.enabled else 0.0
+
+    def record(self, stage, since):
+        if not self.enabled:
+            return 0.0
+        now = time.perf_counter()
+        elapsed = now - since
+        bucket = min(int(elapsed * 1e6).bit_length(), self.NUM_BUCKETS - 1)
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [0] * self.NUM_BUCKETS
+                self.totals[stage] = 0.0
+                self.maxima[stage] = 0.0
+            histogram[bucket] += 1
+            self.totals[stage] += elapsed
+            if elapsed > self.maxima[stage]:
+                self.maxima[stage] = elapsed
+        return now
+
+    @staticmethod
+    def _quantile_ms(histogram, count, q):
+        cumulative = np.cumsum(histogram)
+        bucket = int(np.searchsorted(cumulative, q * count))
+        return (2 ** bucket) / 1000.0
+
+    def stats(self):
+        with self.lock:
+            result = {}
+            for stage, histogram in self.histograms.items():
+                count = sum(histogram)
+                result[stage] = {
+                    'count': count,
+                    'mean_ms': self.totals[stage] / count * 1000.0,
+                    'p50_ms': self._quantile_ms(histogram, count, 0.5),
+                    'p99_ms': self._quantile_ms(histogram, count, 0.99),
+                    'max_ms': self.maxima[stage] * 1000.0,
+                }
+            return result
+
+def get_lr_channel_map(eeg_channels):
+    sorted_channels = sorted(eeg_channels)
+    midpoint = len(sorted_channels) // 2
+    left_channels = sorted_channels[:midpoint]
+    right_channels = sorted_channels[midpoint:]
+    if len(sorted_channels) % 2 != 0:
+        right_channels.insert(0, sorted_channels[midpoint])
+    if not left_channels: left_channels = right_channels
+    if not right_channels: right_channels = left_channels
+    return {'left': left_channels, 'right': right_channels}
+
+# --- Montage ---
+# Regions come from the board's 10-20 electrode names (odd numbers on the
+# left, even on the right, 'z' on the midline; the letter prefix gives the
+# lobe), from side labels such as L1/R1 on boards without 10-20 names, or
+# from a user layout, and are compiled into a channel-by-region
+# weight matrix plus a padded index array. Regional aggregation is then one
+# matrix product (mean) or one gather (median) per tick.
+ELECTRODE_LOBES = {'FP': 'frontal', 'AF': 'frontal', 'F': 'frontal', 'FC': 'central', 'FT': 'temporal',
+                   'C': 'central', 'T': 'temporal', 'TP': 'temporal', 'CP': 'parietal', 'P': 'parietal',
+                   'PO': 'occipital', 'O': 'occipital', 'I': 'occipital'}
+# Earlobe and mastoid sites have a side but belong to no lobe
+ELECTRODE_PREFIXES = set(ELECTRODE_LOBES) | {'A', 'M'}
+MONTAGE_LAYOUTS = ('hemispheres', 'lobes')
+
+def parse_electrode(name):
+    # 'AF7' -> ('AF', 'left'), 'Cz' -> ('C', 'midline'); None if not a 10-20 name
+    match = re.fullmatch(r'([A-Za-z]+?)(\d+|[zZ])', name.strip())
+    if not match or match.group(1).upper() not in ELECTRODE_PREFIXES:
+        return None
+    prefix, suffix = match.group(1).upper(), match.group(2)
+    if suffix in 'zZ':
+        return prefix, 'midline'
+    return prefix, 'left' if int(suffix) % 2 else 'right'
+
+def parse_side(name):
+    # 'L2' -> 'left', 'R1' -> 'right'; None for anything else
+    match = re.fullmatch(r'([LRlr])\d+', name.strip())
+    return None if not match else 'left' if match.group(1).upper() == 'L' else 'right'
+
+class Montage:
+    def __init__(self, eeg_channels, eeg_names, region_weights):
+        # region_weights: {region: {channel: weight}}, channels as board rows
+        self.eeg_channels = list(eeg_channels)
+        self.eeg_names = list(eeg_names)
+        self.regions = tuple(region_weights)
+        positions = {ch: i for i, ch in enumerate(self.eeg_channels)}
+        self.weights = np.zeros((len(self.eeg_channels), len(self.regions)))
+        members = []
+        for r, channel_weights in enumerate(region_weights.values()):
+            idx = [positions[ch] for ch in channel_weights]
+            self.weights[idx, r] = list(channel_weights.values())
+            members.append(idx)
+        width = max((len(idx) for idx in members), default=0)
+        self.index = np.full((len(self.regions), max(width, 1)), len(self.eeg_channels))
+        for r, idx in enumerate(members):
+            self.index[r, :len(idx)] = idx
+
+    @property
+    def channel_map(self):
+        return {region: [self.eeg_channels[i] for i in np.flatnonzero(self.weights[:, r])]
+                for r, region in enumerate(self.regions)}
+
+    @property
+    def spec(self):
+        # Name-based layout, as accepted by build_montage
+        return {region: {self.eeg_names[i]: float(self.weights[i, r]) for i in np.flatnonzero(self.weights[:, r])}
+                for r, region in enumerate(self.regions)}
+
+    def aggregate(self, channel_metrics, aggregation='mean'):
+        # Only regions with at least one valid channel are returned
+        valid = np.isfinite(channel_metrics)
+        if aggregation == 'median':
+            # The index pads with one past the last channel, which gathers a NaN
+            padded = np.append(np.where(valid, channel_metrics, np.nan), np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                values = np.nanmedian(padded[self.index], axis=1)
+        else:
+            total = valid @ self.weights
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.where(valid, channel_metrics, 0.0) @ self.weights / total
+        return {region: float(v) for region, v in zip(self.regions, values) if np.isfinite(v)}
+
+def parse_montage_layout(layout):
+    # Shape check only; channel names are matched against the board on connect
+    if isinstance(layout, str):
+        if layout not in MONTAGE_LAYOUTS: raise ValueError(f"unknown layout '{layout}'")
+        return layout
+    if not isinstance(layout, dict) or not layout:
+        raise ValueError("expected 'hemispheres', 'lobes' or {region: [channels]}")
+    for region, members in layout.items():
+        if not region or not isinstance(members, (list, dict)) or not members:
+            raise ValueError(f"region '{region}' needs a list of channels or a {{channel: weight}} map")
+        if not all(isinstance(member, (str, int)) and not isinstance(member, bool) for member in members):
+            raise ValueError(f"channels in region '{region}' must be names or numbers")
+        if isinstance(members, dict) and not all(isinstance(w, (int, float)) and not isinstance(w, bool) and w > 0
+                                                 for w in members.values()):
+            raise ValueError(f"weights in region '{region}' must be positive numbers")
+    return layout
+
+def build_montage(eeg_channels, eeg_names, layout='hemispheres'):
+    # layout: 'hemispheres', 'lobes', or {region: [names or channels]} /
+    # {region: {name or channel: weight}} for a user-defined montage
+    eeg_channels = list(eeg_channels)
+    eeg_names = list(eeg_names) if eeg_names and len(eeg_names) == len(eeg_channels) else [str(ch) for ch in eeg_channels]
+    if isinstance(layout, dict):
+        by_name = {name.upper(): ch for name, ch in zip(eeg_names, eeg_channels)}
+        region_weights = {}
+        for region, members in layout.items():
+            if not isinstance(members, dict):
+                members = {member: 1.0 for member in members}
+            channel_weights = {}
+            for member, weight in members.items():
+                channel = by_name.get(str(member).upper())
+                if channel is None and str(member).isdigit() and int(member) in eeg_channels:
+                    channel = int(member)
+                if channel is None:
+                    raise ValueError(f"Unknown channel '{member}' in region '{region}'")
+                channel_weights[channel] = float(weight)
+            region_weights[region] = channel_weights
+        return Montage(eeg_channels, eeg_names, region_weights)
+    if layout not in MONTAGE_LAYOUTS:
+        raise ValueError(f"Unknown montage layout '{layout}'")
+    region_weights = {}
+    for name, channel in zip(eeg_names, eeg_channels):
+        parsed = parse_electrode(name)
+        if parsed is None: continue
+        prefix, side = parsed
+        region = side if layout == 'hemispheres' else ELECTRODE_LOBES.get(prefix)
+        if region:
+            region_weights.setdefault(region, {})[channel] = 1.0
+    if layout == 'lobes' and not region_weights:
+        raise ValueError("no 10-20 electrode names to group into lobes")
+    if layout == 'hemispheres':
+        if 'left' not in region_weights or 'right' not in region_weights:
+            # Names without 10-20 positions: use side labels (L1, R1) if every
+            # channel has one, otherwise split the channel list
+            sides = [parse_side(name) for name in eeg_names]
+            if all(sides) and {'left', 'right'} <= set(sides):
+                region_weights = {}
+                for side, channel in zip(sides, eeg_channels):
+                    region_weights.setdefault(side, {})[channel] = 1.0
+            else:
+                region_weights = {region: {ch: 1.0 for ch in channels} for region, channels in get_lr_channel_map(eeg_channels).items()}
+        region_weights = {region: region_weights[region] for region in ('left', 'right', 'midline') if region in region_weights}
+    return Montage(eeg_channels, eeg_names, region_weights)
+
+# --- Session Recording ---
+# A recording is a directory of raw column files plus header.json. Each column
+# is a (rows, width) array appended through a memory map that grows one
+# preallocated chunk at a time and is trimmed to its final length on close.
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings')
+
+class ColumnWriter:
+    def __init__(self, path, dtype, width, chunk_rows):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.capacity = 0
+        self.map = None
+        open(path, 'wb').close()
+        self._grow()
+
+    def _resize(self, rows):
+        if self.map is not None:
+            self.map.flush()
+            self.map = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(rows * self.width * self.dtype.itemsize)
+
+    def _grow(self):
+        self.capacity += self.chunk_rows
+        self._resize(self.capacity)
+        self.map = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(self.capacity, self.width))
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, self.width)
+        while self.rows + len(rows) > self.capacity:
+            self._grow()
+        self.map[self.rows:self.rows + len(rows)] = rows
+        self.rows += len(rows)
+
+    def close(self):
+        self._resize(self.rows)
+
+    def describe(self):
+        return {'dtype': self.dtype.str, 'width': self.width, 'rows': self.rows}
+
+# Everything is handed to a writer thread; the data thread only enqueues
+# references to arrays it no longer touches.
+class SessionRecorder:
+    def __init__(self, board_id, sampling_rate, eeg_channels, eeg_names, band_names, regions, montage=None,
+                 session_id='default', directory=RECORDINGS_DIR, max_pending=512):
+        # Sessions on the same board type can start in the same second, so the
+        # session is part of the name and an existing directory is an error
+        session_name = re.sub(r'[^A-Za-z0-9_-]+', '_', str(session_id)).strip('_') or 'default'
+        self.path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}_board{board_id}_{session_name}")
+        os.makedirs(directory, exist_ok=True)
+        os.mkdir(self.path)
+        num_channels = len(eeg_channels)
+        eeg_chunk = int(sampling_rate * 60)
+        self.regions = list(regions)
+        self.header = {
+            'format': 1,
+            'board_id': board_id,
+            'sampling_rate': sampling_rate,
+            'eeg_channels': list(eeg_channels),
+            'eeg_names': list(eeg_names),
+            'band_names': list(band_names),
+            'regions': self.regions,
+            'montage': montage,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.columns = {
+            'eeg': ColumnWriter(os.path.join(self.path, 'eeg.bin'), '<f4', num_channels, eeg_chunk),
+            'eeg_timestamp': ColumnWriter(os.path.join(self.path, 'eeg_timestamp.bin'), '<f8', 1, eeg_chunk),
+            'feature_timestamp': ColumnWriter(os.path.join(self.path, 'feature_timestamp.bin'), '<f8', 1, 600),
+            'band_powers': ColumnWriter(os.path.join(self.path, 'band_powers.bin'), '<f4', num_channels * len(band_names), 600),
+            'region_metrics': ColumnWriter(os.path.join(self.path, 'region_metrics.bin'), '<f4', len(self.regions), 600),
+            'emas': ColumnWriter(os.path.join(self.path, 'emas.bin'), '<f4', len(self.regions), 600),
+            'trigger_timestamp': ColumnWriter(os.path.join(self.path, 'trigger_timestamp.bin'), '<f8', 1, 64),
+            'trigger_state': ColumnWriter(os.path.join(self.path, 'trigger_state.bin'), '<u1', 1, 64),
+        }
+        self.dropped = 0
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        try:
+            self.pending.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_eeg(self, eeg_data, timestamps):
+        self._put(('eeg', eeg_data, timestamps))
+
+    def on_features(self, features):
+        self._put(('features', features))
+
+    def record_trigger(self, state, timestamp):
+        self._put(('trigger', state, timestamp))
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None: break
+            try:
+                if item[0] == 'eeg':
+                    self.columns['eeg'].append(item[1].T)
+                    self.columns['eeg_timestamp'].append(item[2])
+                elif item[0] == 'features':
+                    features = item[1]
+                    self.columns['feature_timestamp'].append(features['timestamp'])
+                    self.columns['band_powers'].append(features['band_powers'].ravel())
+                    self.columns['region_metrics'].append([features['regions'].get(r, np.nan) for r in self.regions])
+                    self.columns['emas'].append([features['emas'].get(r, 0.0) for r in self.regions])
+                elif item[0] == 'trigger':
+                    self.columns['trigger_timestamp'].append(item[2])
+                    self.columns['trigger_state'].append(self.regions.index(item[1]) if item[1] in self.regions else 255)
+            except Exception as e:
+                print(f"Error writing recording: {e}")
+
+    def close(self, **settings):
+        self.pending.put(None)
+        self.thread.join()
+        for column in self.columns.values():
+            column.close()
+        self.header.update(settings)
+        self.header['stopped'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.header['dropped_items'] = self.dropped
+        self.header['columns'] = {name: column.describe() for name, column in self.columns.items()}
+        with open(os.path.join(self.path, 'header.json'), 'w') as f:
+            json.dump(self.header, f, indent=2)
+        return self.path
+
+def load_recording(path):
+    with open(os.path.join(path, 'header.json')) as f:
+        header = json.load(f)
+    columns = {}
+    for name, info in header['columns'].items():
+        if info['rows'] == 0:
+            columns[name] = np.empty((0, info['width']), dtype=info['dtype'])
+        else:
+            columns[name] = np.memmap(os.path.join(path, f"{name}.bin"), dtype=info['dtype'], mode='r',
+                                      shape=(info['rows'], info['width']))
+    return header, columns
+
+def replay_recording(path, metric_mode=None, smoothing_factor=None, sensitivity=None, baselines=None,
+                     refresh_rate_hz=5, cooldown_s=None, speed=None, decision=None):
+    # Feeds a recording's raw EEG back through the pipeline and the decision
+    # engine. Dwell and refractory periods use recorded timestamps, so
+    # speed=None (as fast as possible) gives the same triggers as a real-time
+    # replay.
+    header, columns = load_recording(path)
+    metric_mode = metric_mode or header.get('metric_mode', 'alpha')
+    smoothing_factor = smoothing_factor if smoothing_factor is not None else header.get('smoothing_factor', 0.2)
+    sensitivity = sensitivity if sensitivity is not None else header.get('sensitivity', 2.0)
+    # Overrides replace only the regions they name
+    baselines = {**header.get('baselines', {}), **(baselines or {})}
+    sampling_rate = header['sampling_rate']
+    eeg_channels = header['eeg_channels']
+    montage = build_montage(eeg_channels, header['eeg_names'], header.get('montage') or 'hemispheres')
+    # Recordings made before filters were saved used the defaults
+    pipeline = ProcessingPipeline(eeg_channels, sampling_rate, montage, header.get('window_seconds', 2),
+                                  filters=header.get('filters') or DEFAULT_FILTERS)
+    decision = {**DEFAULT_DECISION, **header.get('decision', {}), **(decision or {})}
+    if cooldown_s is not None: decision['refractory_s'] = cooldown_s
+    engine = DecisionEngine(montage.regions)
+    engine.set_baselines(baselines)
+    engine.configure(sensitivity, decision, header.get('state_settings'))
+    eeg = columns['eeg']
+    timestamps = columns['eeg_timestamp'][:, 0]
+    chunk = max(1, int(sampling_rate / refresh_rate_hz))
+    triggers = []
+    ticks = 0
+    start = time.perf_counter()
+    for begin in range(0, len(eeg), chunk):
+        end = min(begin + chunk, len(eeg))
+        pipeline.push(np.asarray(eeg[begin:end], dtype=np.float64).T)
+        if speed:
+            delay = start + end / sampling_rate / speed - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+        if not pipeline.ready:
+            continue
+        ticks += 1
+        timestamp = float(timestamps[end - 1])
+        features = pipeline.compute(metric_mode, smoothing_factor, timestamp)
+        if features['artifact']:
+            continue
+        for state, action in engine.update(features['emas'], timestamp):
+            if action != 'release':
+                triggers.append((timestamp, state))
+    elapsed = time.perf_counter() - start
+    duration = len(eeg) / sampling_rate
+    recorded_states = [header['regions'][i] if i < len(header['regions']) else 'unknown'
+                       for i in columns['trigger_state'][:, 0]]
+    return {
+        'duration_seconds': duration,
+        'elapsed_seconds': elapsed,
+        'speedup': duration / elapsed if elapsed > 0 else float('inf'),
+        'ticks': ticks,
+        'triggers': triggers,
+        'recorded_triggers': list(zip(columns['trigger_timestamp'][:, 0].tolist(), recorded_states)),
+    }
+
+# --- Batched Spectral Features ---
+# All spectral work operates on (channels, samples) arrays so every EEG
+# channel is transformed in a single NumPy pass.
+BANDS = {'delta': (1.0, 4.0), 'theta': (4.0, 7.0), 'alpha': (7.0, 13.0), 'beta': (13.0, 30.0), 'gamma': (30.0, 45.0)}
+
+def band_weight_matrix(freqs, bands):
+    # Trapezoidal integration over the bins inside [lo, hi], like DataFilter.get_band_power
+    weights = np.zeros((len(freqs), len(bands)))
+    step = freqs[1] - freqs[0]
+    for b, (lo, hi) in enumerate(bands.values()):
+        idx = np.flatnonzero((freqs >= lo) & (freqs <= hi))
+        if len(idx) > 1:
+            weights[idx, b] = step
+            weights[idx[0], b] = weights[idx[-1], b] = step / 2
+    return weights
+
+def segment_psds(segments, window, scale):
+    # segments: (..., nfft) -> one-sided PSD per segment, normalised like DataFilter.get_psd_welch
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    psd = np.abs(np.fft.rfft(segments * window, axis=-1)) ** 2 * scale
+    psd[..., 1:-1] *= 2
+    return psd
+
+# --- Metric Registry ---
+# A metric is an expression over band powers, evaluated per channel, plus the
+# reduction that turns a region's channels into one value. Expressions are
+# parsed, checked and compiled once; evaluation then works on whole columns of
+# the band-power matrix the spectral stage already produces, so adding a
+# metric adds no spectral work.
+METRIC_FUNCTIONS = {'log': np.log, 'log10': np.log10, 'sqrt': np.sqrt, 'abs': np.abs}
+METRIC_AGGREGATIONS = ('mean', 'median')
+METRIC_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+                ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+MIN_DIVISOR_POWER = 0.001
+MAX_METRIC_EXPONENT = 4
+
+class Metric:
+    def __init__(self, name, expression, label=None, aggregation='mean'):
+        if aggregation not in METRIC_AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{aggregation}'")
+        tree = ast.parse(expression, mode='eval')
+        divisors = []
+        for node in ast.walk(tree):
+            if not isinstance(node, METRIC_NODES):
+                raise ValueError(f"'{type(node).__name__}' is not allowed in a metric expression")
+            if isinstance(node, ast.Name) and node.id not in BANDS and node.id not in METRIC_FUNCTIONS:
+                raise ValueError(f"Unknown band '{node.id}'; available: {', '.join(BANDS)}")
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in METRIC_FUNCTIONS
+                                                   and len(node.args) == 1 and not node.keywords):
+                raise ValueError(f"Only {', '.join(METRIC_FUNCTIONS)} of one argument may be called")
+            if isinstance(node, ast.Constant):
+                if not isinstance(node.value, (int, float)):
+                    raise ValueError(f"Unsupported constant {node.value!r}")
+                # Floats overflow at once where Python ints would grow without bound
+                node.value = float(node.value)
+            if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+                exponent = node.right.operand if isinstance(node.right, ast.UnaryOp) else node.right
+                if not (isinstance(exponent, ast.Constant) and isinstance(exponent.value, (int, float))
+                        and abs(exponent.value) <= MAX_METRIC_EXPONENT):
+                    raise ValueError(f"Exponents must be numbers between -{MAX_METRIC_EXPONENT} and {MAX_METRIC_EXPONENT}")
+            if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+                divisors.append(node.right)
+        self.name = name
+        self.expression = expression
+        self.label = label or name
+        self.aggregation = aggregation
+        band_names = list(BANDS)
+        used = {n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and n.id in BANDS}
+        self.band_index = {band: band_names.index(band) for band in used}
+        # Near-zero divisors give meaningless ratios rather than real values
+        self.divisor_codes = [compile(ast.Expression(node), f'<metric {name} divisor>', 'eval') for node in divisors]
+        self.code = compile(tree, f'<metric {name}>', 'eval')
+        try:
+            self.evaluate(np.ones((1, len(BANDS))))  # catches misuse such as calling a band
+        except ArithmeticError as e:
+            # Constant parts are plain floats, so 1/0 or an overflow fails the same way every tick
+            raise ValueError(f"Constant part of the expression cannot be evaluated: {e}") from None
+
+    @property
+    def spec(self):
+        return {'name': self.name, 'expression': self.expression, 'label': self.label, 'aggregation': self.aggregation}
+
+    def evaluate(self, band_powers):
+        # (channels, bands) -> (channels,); NaN marks channels that cannot produce a value
+        columns = {band: band_powers[:, i] for band, i in self.band_index.items()}
+        namespace = {'__builtins__': {}, **METRIC_FUNCTIONS}
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            values = eval(self.code, namespace, columns)
+            valid = np.isfinite(values)
+            for code in self.divisor_codes:
+                valid &= np.abs(eval(code, namespace, columns)) > MIN_DIVISOR_POWER
+        return np.where(np.broadcast_to(valid, band_powers.shape[:1]), values, np.nan)
+
+METRICS = {}
+
+def register_metric(name, expression, label=None, aggregation='mean'):
+    METRICS[name] = Metric(name, expression, label, aggregation)
+    return METRICS[name]
+
+def ensure_metric(spec):
+    # Used by worker processes, whose registry only holds the built-ins
+    metric = METRICS.get(spec['name'])
+    if metric is None or metric.spec != spec:
+        metric = register_metric(**spec)
+    return metric
+
+register_metric('focus', 'beta / alpha', 'Focus Ratio (Beta/Alpha)')
+register_metric('alpha', 'alpha', 'Alpha Power (Relaxation)')
+register_metric('theta_beta', 'theta / beta', 'Theta/Beta Ratio')
+register_metric('engagement', 'beta / (alpha + theta)', 'Engagement (Beta/(Alpha+Theta))')
+register_metric('relative_alpha', 'alpha / (delta + theta + alpha + beta + gamma)', 'Relative Alpha', 'median')
+
+# --- Streaming Filters ---
+# IIR filters whose state carries over from one chunk to the next, so each
+# tick filters only the samples that just arrived and there are no edge
+# transients at chunk boundaries. The biquad cascade is folded into a single
+# state-space system; a chunk of n samples is then one matrix product per
+# term for every channel at once, using matrices cached per chunk length.
+DEFAULT_FILTERS = {'notch': (50.0, 60.0), 'highpass': 1.0, 'bandpass': None}
+
+def parse_filter_settings(data, current, sampling_rate=None):
+    # notch: [Hz, ...] or None; highpass: Hz or None; bandpass: [low, high] or None.
+    # Frequencies must lie strictly between 0 and Nyquist when the rate is known.
+    nyquist = sampling_rate / 2 if sampling_rate else np.inf
+    settings = dict(current)
+    for key, value in data.items():
+        if key not in DEFAULT_FILTERS:
+            raise ValueError(f"unknown filter '{key}'")
+        if value is None:
+            settings[key] = None
+            continue
+        if key == 'highpass':
+            value = float(value)
+            frequencies = (value,)
+        elif not isinstance(value, (list, tuple)):
+            raise ValueError(f"{key} must be a list of frequencies")
+        else:
+            value = frequencies = tuple(float(f) for f in value)
+            if key == 'bandpass' and (len(value) != 2 or not value[0] < value[1]):
+                raise ValueError("bandpass must be a [low, high] pair with low < high")
+        if not all(0 < f < nyquist for f in frequencies):
+            raise ValueError(f"{key} frequencies must be above 0 and below {nyquist:g} Hz")
+        settings[key] = value
+    return settings
+
+def biquad(kind, f0, sampling_rate, q=0.7071):
+    # RBJ audio-EQ-cookbook coefficients, normalised so a0 == 1
+    w0 = 2 * np.pi * f0 / sampling_rate
+    cos_w0, alpha = np.cos(w0), np.sin(w0) / (2 * q)
+    if kind == 'notch':
+        b = [1.0, -2 * cos_w0, 1.0]
+    elif kind == 'highpass':
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    elif kind == 'lowpass':
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+    else:
+        raise ValueError(f"Unknown filter type: {kind}")
+    a0 = 1 + alpha
+    return np.array(b) / a0, np.array([-2 * cos_w0, 1 - alpha]) / a0
+
+def filter_sections(filters, sampling_rate):
+    nyquist = sampling_rate / 2
+    sections = [biquad('notch', f, sampling_rate, q=30.0) for f in filters.get('notch') or () if f < nyquist]
+    if filters.get('highpass'):
+        sections.append(biquad('highpass', filters['highpass'], sampling_rate))
+    if filters.get('bandpass'):
+        lo, hi = filters['bandpass']
+        sections.append(biquad('highpass', lo, sampling_rate))
+        if hi < nyquist:
+            sections.append(biquad('lowpass', hi, sampling_rate))
+    return sections
+
+def sections_state_space(sections):
+    # Transposed direct form II per biquad, chained in series
+    A, B, C, D = np.zeros((0, 0)), np.zeros(0), np.zeros(0), 1.0
+    for (b0, b1, b2), (a1, a2) in sections:
+        As = np.array([[-a1, 1.0], [-a2, 0.0]])
+        Bs = np.array([b1 - a1 * b0, b2 - a2 * b0])
+        Cs = np.array([1.0, 0.0])
+        n = len(B)
+        A_new = np.zeros((n + 2, n + 2))
+        A_new[:n, :n] = A
+        A_new[n:, :n] = np.outer(Bs, C)
+        A_new[n:, n:] = As
+        A, B, C, D = A_new, np.concatenate([B, Bs * D]), np.concatenate([b0 * C, Cs]), b0 * D
+    return A, B, C, D
+
+class StreamingFilterBank:
+    MAX_BLOCK = 32
+
+    def __init__(self, num_channels, sampling_rate, filters=DEFAULT_FILTERS):
+        self.A, self.B, self.C, self.D = sections_state_space(filter_sections(filters, sampling_rate))
+        self.order = len(self.B)
+        self.state = None
+        self.num_channels = num_channels
+        self.blocks = {}
+
+    @property
+    def nbytes(self):
+        return sum(m.nbytes for block in self.blocks.values() for m in block)
+
+    def _block(self, n):
+        # y = x @ T + s @ O ; s' = s @ P + x @ Q for a chunk of n samples
+        if n not in self.blocks:
+            A, B, C, D = self.A, self.B, self.C, self.D
+            powers = [np.eye(self.order)]
+            for _ in range(n):
+                powers.append(powers[-1] @ A)
+            markov = np.array([D] + [C @ powers[k] @ B for k in range(n - 1)])
+            T = np.zeros((n, n))
+            for k in range(n):
+                T[k, k:] = markov[:n - k]
+            O = np.stack([C @ powers[k] for k in range(n)], axis=1)
+            P = powers[n].T
+            Q = np.stack([powers[n - 1 - k] @ B for k in range(n)])
+            self.blocks[n] = (T, O, P, Q)
+        return self.blocks[n]
+
+    def process(self, samples):
+        if self.order == 0:
+            return samples
+        if self.state is None:
+            # Start from the steady state for the first sample, as if the
+            # signal had been there forever, so a DC offset causes no step
+            steady = np.linalg.solve(np.eye(self.order) - self.A, self.B)
+            self.state = np.outer(samples[:, 0], steady)
+        out = np.empty_like(samples)
+        for start in range(0, samples.shape[1], self.MAX_BLOCK):
+            x = samples[:, start:start + self.MAX_BLOCK]
+            T, O, P, Q = self._block(x.shape[1])
+            out[:, start:start + x.shape[1]] = x @ T + self.state @ O
+            self.state = self.state @ P + x @ Q
+        return out
+
+# --- Incremental Spectral Estimation ---
+# Welch-style PSD kept up to date one segment at a time. Only newly arrived
+# samples are transformed; per-segment spectra and band powers live in a ring
+# so the window average is updated by dropping the oldest segment.
+class IncrementalWelch:
+    def __init__(self, num_channels, sampling_rate, nfft, window_seconds, bands=BANDS):
+        self.nfft = nfft
+        self.hop = nfft // 2
+        self.num_segments = max(1, (int(sampling_rate * window_seconds) - nfft) // self.hop + 1)
+        self.window = np.hanning(nfft)
+        self.scale = 1.0 / (sampling_rate * nfft)
+        self.freqs = np.fft.rfftfreq(nfft, 1.0 / sampling_rate)
+        self.band_names = tuple(bands)
+        self.band_weights = band_weight_matrix(self.freqs, bands)
+        self.segment_band_powers = np.zeros((self.num_segments, num_channels, len(self.band_names)))
+        self.band_power_sum = np.zeros((num_channels, len(self.band_names)))
+        self.pending = np.empty((num_channels, 0))
+        self.head = 0
+        self.count = 0
+
+    @property
+    def ready(self):
+        return self.count >= self.num_segments
+
+    @property
+    def nbytes(self):
+        return self.segment_band_powers.nbytes + self.band_power_sum.nbytes + self.pending.nbytes
+
+    def reset(self):
+        self.pending = np.empty((self.pending.shape[0], 0))
+        self.band_power_sum[:] = 0.0
+        self.head = 0
+        self.count = 0
+
+    def push(self, samples):
+        self.pending = np.concatenate([self.pending, samples], axis=1)
+        available = self.pending.shape[1]
+        if available < self.nfft:
+            return
+        # Every complete segment in the pending samples is transformed in one batch
+        segments = np.lib.stride_tricks.sliding_window_view(self.pending, self.nfft, axis=1)[:, ::self.hop]
+        psds = segment_psds(segments, self.window, self.scale)
+        band_powers = psds @ self.band_weights
+        for i in range(band_powers.shape[1]):
+            self._add_segment(band_powers[:, i])
+        self.pending = self.pending[:, band_powers.shape[1] * self.hop:]
+
+    def _add_segment(self, band_powers):
+        if self.count >= self.num_segments:
+            self.band_power_sum -= self.segment_band_powers[self.head]
+        self.segment_band_powers[self.head] = band_powers
+        self.band_power_sum += band_powers
+        self.head = (self.head + 1) % self.num_segments
+        self.count += 1
+        if self.head == 0:
+            # Resync the running sum once per lap so float error cannot accumulate
+            self.band_power_sum = self.segment_band_powers.sum(axis=0)
+
+    def band_powers(self):
+        return self.band_power_sum / max(min(self.count, self.num_segments), 1)
+
+    def band_power(self, band):
+        return self.band_powers()[:, self.band_names.index(band)]
+
+# --- Artifact Rejection ---
+# Per-channel statistics are reduced once per epoch (a quarter second) and
+# kept in a ring that spans the analysis window, so each tick only touches
+# newly arrived samples. A channel is rejected while its window is too noisy,
+# flat, clipped or dominated by mains hum (measured before the notch), or
+# while an epoch inside the window jumps far above that channel's own running
+# amplitude (blinks, jaw clenches, cable motion). When too many channels are
+# rejected at once the whole epoch counts as an artifact and no trigger may
+# fire from it.
+LINE_NOISE_BANDS = {'line_50': (48.0, 52.0), 'line_60': (58.0, 62.0), 'broadband': (1.0, 45.0)}
+
+class ArtifactDetector:
+    def __init__(self, num_channels, sampling_rate, window_seconds, epoch_seconds=0.25, max_std=100.0, min_std=0.1,
+                 max_ptp=500.0, max_line_ratio=1.0, burst_factor=4.0, baseline_alpha=0.05, max_bad_fraction=0.5):
+        self.epoch_samples = max(1, int(sampling_rate * epoch_seconds))
+        self.num_epochs = max(1, int(round(window_seconds / epoch_seconds)))
+        self.max_std = max_std
+        self.min_std = min_std
+        self.max_ptp = max_ptp
+        self.max_line_ratio = max_line_ratio
+        self.burst_factor = burst_factor
+        self.baseline_alpha = baseline_alpha
+        self.max_bad_fraction = max_bad_fraction
+        self.epoch_sum = np.zeros((self.num_epochs, num_channels))
+        self.epoch_sumsq = np.zeros((self.num_epochs, num_channels))
+        self.epoch_ptp = np.zeros((self.num_epochs, num_channels))
+        self.epoch_burst = np.zeros((self.num_epochs, num_channels), dtype=bool)
+        self.baseline_ptp = np.full(num_channels, np.nan)
+        self.pending = np.empty((num_channels, 0))
+        self.head = 0
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        return (self.epoch_sum.nbytes + self.epoch_sumsq.nbytes + self.epoch_ptp.nbytes +
+                self.epoch_burst.nbytes + self.baseline_ptp.nbytes + self.pending.nbytes)
+
+    def push(self, samples):
+        self.pending = np.concatenate([self.pending, samples], axis=1)
+        num_new = self.pending.shape[1] // self.epoch_samples
+        if num_new == 0:
+            return
+        # (channels, epochs, samples) -> per-epoch stats for every channel at once
+        epochs = self.pending[:, :num_new * self.epoch_samples].reshape(self.pending.shape[0], num_new, self.epoch_samples)
+        self.pending = self.pending[:, num_new * self.epoch_samples:]
+        epochs = epochs[:, -self.num_epochs:]
+        sums = epochs.sum(axis=2).T
+        sumsqs = np.einsum('ces,ces->ec', epochs, epochs)
+        ptps = np.ptp(epochs, axis=2).T
+        for i in range(ptps.shape[0]):
+            self._add_epoch(sums[i], sumsqs[i], ptps[i])
+
+    def _add_epoch(self, epoch_sum, epoch_sumsq, epoch_ptp):
+        baseline = self.baseline_ptp
+        with np.errstate(invalid='ignore'):
+            burst = epoch_ptp > self.burst_factor * baseline
+        # Winsorised EMA: a single burst barely moves the baseline, while a
+        # sustained change in level is accepted within a few seconds.
+        clipped = np.where(np.isnan(baseline), epoch_ptp, np.minimum(epoch_ptp, self.burst_factor * baseline))
+        self.baseline_ptp = np.where(np.isnan(baseline), clipped, baseline + self.baseline_alpha * (clipped - baseline))
+        self.epoch_sum[self.head] = epoch_sum
+        self.epoch_sumsq[self.head] = epoch_sumsq
+        self.epoch_ptp[self.head] = epoch_ptp
+        self.epoch_burst[self.head] = burst
+        self.head = (self.head + 1) % self.num_epochs
+        self.count += 1
+
+    def assess(self, line_ratio):
+        filled = min(self.count, self.num_epochs)
+        if filled == 0:
+            return np.zeros(self.epoch_sum.shape[1], dtype=bool), False
+        n = filled * self.epoch_samples
+        mean = self.epoch_sum[:filled].sum(axis=0) / n
+        std = np.sqrt(np.maximum(self.epoch_sumsq[:filled].sum(axis=0) / n - mean * mean, 0.0))
+        bad_channels = ((std > self.max_std) | (std < self.min_std) |
+                        (self.epoch_ptp[:filled].max(axis=0) > self.max_ptp) |
+                        (line_ratio > self.max_line_ratio) |
+                        self.epoch_burst[:filled].any(axis=0))
+        return bad_channels, bool(bad_channels.mean() > self.max_bad_fraction)
+
+# --- Processing Pipeline ---
+# Everything between "new EEG samples" and "features for this tick". The data
+# thread feeds it from the board; benchmark.py drives it headless.
+class ProcessingPipeline:
+    def __init__(self, eeg_channels, sampling_rate, montage, window_seconds=2, timers=None, filters=DEFAULT_FILTERS):
+        self.sampling_rate = sampling_rate
+        self.num_samples_in_window = int(sampling_rate * window_seconds)
+        nfft = DataFilter.get_nearest_power_of_two(sampling_rate)
+        self.montage = montage
+        # The notch runs as a second stage so mains hum can still be measured
+        # on the high-passed stream before it is removed
+        self.filters = StreamingFilterBank(len(eeg_channels), sampling_rate, {**filters, 'notch': None})
+        self.notch = StreamingFilterBank(len(eeg_channels), sampling_rate, {'notch': filters.get('notch')})
+        self.line_noise = IncrementalWelch(len(eeg_channels), sampling_rate, nfft, window_seconds, LINE_NOISE_BANDS)
+        self.spectral = IncrementalWelch(len(eeg_channels), sampling_rate, nfft, window_seconds, BANDS)
+        self.artifacts = ArtifactDetector(len(eeg_channels), sampling_rate, window_seconds)
+        # Only the sample count is needed; the spectral estimator keeps its own state
+        self.samples_seen = 0
+        self.metric_emas = {region: 0.0 for region in montage.regions}
+        self.timers = timers if timers is not None else StageTimers()
+
+    @property
+    def ready(self):
+        return self.samples_seen >= self.num_samples_in_window and self.spectral.ready
+
+    @property
+    def nbytes(self):
+        return (self.filters.nbytes + self.notch.nbytes + self.line_noise.nbytes +
+                self.spectral.nbytes + self.artifacts.nbytes)
+
+    def push(self, eeg_data):
+        timers = self.timers
+        t = timers.mark()
+        eeg_data = self.filters.process(eeg_data)
+        t = timers.record('filter', t)
+        self.line_noise.push(eeg_data)
+        t = timers.record('line_noise', t)
+        eeg_data = self.notch.process(eeg_data)
+        t = timers.record('notch', t)
+        self.samples_seen += eeg_data.shape[1]
+        self.spectral.push(eeg_data)
+        t = timers.record('spectral', t)
+        self.artifacts.push(eeg_data)
+        timers.record('artifacts', t)
+
+    def compute(self, metric_mode, smoothing_factor, timestamp):
+        timers = self.timers
+        t = timers.mark()
+        # Band powers come from the incremental estimator over the filtered stream
+        band_powers = self.spectral.band_powers()
+        line = self.line_noise.band_powers()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            line_ratio = np.nan_to_num(np.maximum(line[:, 0], line[:, 1]) / line[:, 2])
+        bad_channels, artifact = self.artifacts.assess(line_ratio)
+        signal_quality = 'bad' if artifact or bad_channels.any() else 'good'
+        t = timers.record('signal_quality', t)
+
+        metric = METRICS[metric_mode]
+        channel_metrics = np.where(bad_channels, np.nan, metric.evaluate(band_powers))
+        metric_values = self.montage.aggregate(channel_metrics, metric.aggregation)
+        t = timers.record('metrics', t)
+
+        # An artifact epoch holds the EMAs instead of dragging them after the
+        # burst; so does a region whose channels were all rejected this tick
+        if not artifact:
+            alpha = smoothing_factor
+            for region, raw_value in metric_values.items():
+                self.metric_emas[region] = (alpha * raw_value) + (1 - alpha) * self.metric_emas[region]
+        timers.record('smoothing', t)
+
+        return {
+            'timestamp': timestamp,
+            'metric_mode': metric_mode,
+            'signal_quality': signal_quality,
+            'artifact': artifact,
+            'bad_channels': np.flatnonzero(bad_channels).tolist(),
+            'band_powers': band_powers,
+            'regions': metric_values,
+            'emas': dict(self.metric_emas),
+        }
+
+    def close(self):
+        pass
+
+# --- Worker Process Offload ---
+# In 'process' execution mode the pipeline runs in a separate process so heavy
+# spectral work does not compete with Flask-SocketIO and pynput for the GIL.
+# Raw samples travel through a shared-memory ring; only the tick request and
+# the small per-tick feature dict go through queues.
+class SharedSampleRing:
+    def __init__(self, num_channels, capacity, name=None):
+        self.capacity = capacity
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=8 + num_channels * capacity * 8)
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.buffer = np.ndarray((num_channels, capacity), dtype=np.float64, buffer=self.shm.buf, offset=8)
+        if self.owner:
+            self.counter[0] = 0
+
+    @property
+    def write_count(self):
+        return int(self.counter[0])
+
+    def write(self, samples):
+        # Samples are written before the counter moves, so a reader never sees
+        # a count that covers unwritten data.
+        n = samples.shape[1]
+        block = samples[:, -self.capacity:]
+        pos = (self.write_count + n - block.shape[1]) % self.capacity
+        first = min(block.shape[1], self.capacity - pos)
+        self.buffer[:, pos:pos + first] = block[:, :first]
+        self.buffer[:, :block.shape[1] - first] = block[:, first:]
+        self.counter[0] += n
+
+    def read(self, start, end):
+        start = max(start, end - self.capacity)
+        begin = start % self.capacity
+        n = end - start
+        if begin + n <= self.capacity:
+            return self.buffer[:, begin:begin + n].copy()
+        return np.concatenate([self.buffer[:, begin:], self.buffer[:, :n - (self.capacity - begin)]], axis=1)
+
+    def close(self):
+        self.counter = self.buffer = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def feature_worker_main(shm_name, capacity, eeg_channels, sampling_rate, montage, window_seconds, filters, requests, results):
+    ring = SharedSampleRing(len(eeg_channels), capacity, name=shm_name)
+    pipeline = ProcessingPipeline(eeg_channels, sampling_rate, montage, window_seconds, filters=filters)
+    read_pos = 0
+    try:
+        while True:
+            request = requests.get()
+            if request is None: break
+            write_count, metric_spec, smoothing_factor, timestamp = request
+            if write_count > read_pos:
+                pipeline.push(ring.read(read_pos, write_count))
+                read_pos = write_count
+            metric_mode = ensure_metric(metric_spec).name
+            results.put(pipeline.compute(metric_mode, smoothing_factor, timestamp) if pipeline.ready else None)
+    except Exception as e:
+        results.put({'error': repr(e)})
+    finally:
+        ring.close()
+
+# Same interface as ProcessingPipeline, backed by a feature_worker_main process
+class ProcessPipeline:
+    def __init__(self, eeg_channels, sampling_rate, montage, window_seconds=2, timers=None, filters=DEFAULT_FILTERS, result_timeout=5.0):
+        context = multiprocessing.get_context('spawn')
+        self.num_samples_in_window = int(sampling_rate * window_seconds)
+        capacity = 4 * self.num_samples_in_window
+        self.ring = SharedSampleRing(len(eeg_channels), capacity)
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=feature_worker_main, daemon=True, args=(
+            self.ring.shm.name, capacity, list(eeg_channels), sampling_rate, montage, window_seconds, dict(filters),
+            self.requests, self.results))
+        self.process.start()
+        self.result_timeout = result_timeout
+        self.metric_emas = {region: 0.0 for region in montage.regions}
+        self.timers = timers if timers is not None else StageTimers()
+
+    @property
+    def ready(self):
+        return self.ring.write_count >= self.num_samples_in_window
+
+    @property
+    def nbytes(self):
+        # Shared ring only; the worker's own pipeline lives in the other process
+        return self.ring.buffer.nbytes
+
+    def push(self, eeg_data):
+        t = self.timers.mark()
+        self.ring.write(eeg_data)
+        self.timers.record('shm_write', t)
+
+    def compute(self, metric_mode, smoothing_factor, timestamp):
+        t = self.timers.mark()
+        self.requests.put((self.ring.write_count, METRICS[metric_mode].spec, smoothing_factor, timestamp))
+        try:
+            features = self.results.get(timeout=self.result_timeout)
+        except queue.Empty:
+            raise RuntimeError("Feature worker process did not respond.")
+        if features and 'error' in features:
+            raise RuntimeError(f"Feature worker failed: {features['error']}")
+        self.timers.record('worker', t)
+        if features:
+            self.metric_emas.update(features['emas'])
+        return features
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
+
+EXECUTION_MODES = {'thread': ProcessingPipeline, 'process': ProcessPipeline}
+
+# --- Decision Engine ---
+# Turns regional EMAs into key actions. Each state (one per montage region)
+# activates when its z-score against the calibrated baseline exceeds the
+# sensitivity and has stayed there for its dwell time, and only releases
+# below a lower threshold (hysteresis), so it cannot chatter around a single
+# cut-off. After firing, a state waits out its
+# refractory period. 'tap' states press once per activation; 'hold' states
+# keep the key down until they release. All states are evaluated together as
+# arrays; when several qualify, the one furthest above its threshold wins.
+DECISION_ACTIONS = ('tap', 'hold')
+DEFAULT_DECISION = {'hysteresis': 0.1, 'dwell_s': 0.2, 'refractory_s': 1.0, 'action': 'tap'}
+
+class DecisionEngine:
+    def __init__(self, states):
+        self.states = tuple(states)
+        n = len(self.states)
+        self.active = np.zeros(n, dtype=bool)
+        # Keys actually held down; releases follow this, not the current
+        # action setting, which may change while a key is down
+        self.pressed = np.zeros(n, dtype=bool)
+        self.above_since = np.full(n, np.nan)
+        self.last_fired = np.full(n, -np.inf)
+        self.set_baselines({})
+        self.configure(2.0)
+
+    def set_baselines(self, baselines):
+        # Uncalibrated states compare the raw EMA (centre 0, scale 1)
+        baselines = normalize_baselines(baselines)
+        self.center = np.array([baselines.get(state, {}).get('center', 0.0) for state in self.states])
+        self.scale = np.array([baselines.get(state, {}).get('scale', 1.0) for state in self.states])
+
+    def configure(self, sensitivity, decision=DEFAULT_DECISION, overrides=None):
+        # overrides: {state: {'sensitivity', 'hysteresis', 'dwell_s', 'refractory_s', 'action'}}
+        overrides = overrides or {}
+        defaults = {**DEFAULT_DECISION, **decision, 'sensitivity': sensitivity}
+        def per_state(key):
+            return [overrides.get(state, {}).get(key, defaults[key]) for state in self.states]
+        self.on = np.array(per_state('sensitivity'), dtype=float)
+        self.off = self.on * (1.0 - np.array(per_state('hysteresis'), dtype=float))
+        self.dwell = np.array(per_state('dwell_s'), dtype=float)
+        self.refractory = np.array(per_state('refractory_s'), dtype=float)
+        self.hold = np.array([action == 'hold' for action in per_state('action')])
+
+    def update(self, emas, now):
+        # Returns [(state, 'tap' | 'press' | 'release')]
+        values = np.array([emas.get(state, np.nan) for state in self.states])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (values - self.center) / self.scale
+            above = z > self.on
+            released = self.active & ~(z > self.off)
+        self.above_since = np.where(above, np.fmin(self.above_since, now), np.nan)
+        self.active &= ~released
+        ready = (above & ~self.active & (now - self.above_since >= self.dwell) &
+                 (now - self.last_fired >= self.refractory))
+        events = [(self.states[i], 'release') for i in np.flatnonzero(released & self.pressed)]
+        self.pressed &= ~released
+        # A held key blocks every other state until it is released
+        if ready.any() and not self.pressed.any():
+            winner = int(np.argmax(np.where(ready, z - self.on, -np.inf)))
+            self.active[winner] = True
+            self.pressed[winner] = self.hold[winner]
+            self.last_fired[winner] = now
+            events.append((self.states[winner], 'press' if self.hold[winner] else 'tap'))
+        return events
+
+    def release_all(self):
+        events = [(self.states[i], 'release') for i in np.flatnonzero(self.pressed)]
+        self.active[:] = False
+        self.pressed[:] = False
+        self.above_since[:] = np.nan
+        return events
+
+# --- Baseline Statistics ---
+# Baselines are running statistics of each region's EMA. Welford's update
+# tracks mean and variance; once max_count samples have been seen the update
+# weight stops shrinking, so old data fades out and the baseline can follow
+# slow drift when adaptation is on. The reported centre and scale are the
+# median and MAD (scaled to match a standard deviation) of the most recent
+# `window` samples, so blinks and bursts barely move them. A baseline loaded
+# from a profile is seeded into that window as evenly spread stand-in
+# samples, so new data moves it one sample at a time.
+class RunningStats:
+    def __init__(self, regions, max_count=3000, window=600):
+        self.regions = tuple(regions)
+        self.max_count = max_count
+        self.recent = np.zeros((window, len(self.regions)))
+        self.reset()
+
+    def reset(self):
+        # Counts are per region so a region with no usable channels can sit
+        # out a push without stalling the others
+        self.count = np.zeros(len(self.regions), dtype=int)
+        self.mean = np.zeros(len(self.regions))
+        self.var = np.zeros(len(self.regions))
+        self.filled = np.zeros(len(self.regions), dtype=int)
+        self.pos = np.zeros(len(self.regions), dtype=int)
+
+    def seed(self, baselines):
+        # Continue from a saved profile instead of starting empty
+        self.reset()
+        self.mean = np.array([baselines[r].get('mean', baselines[r]['center']) for r in self.regions], dtype=float)
+        self.var = np.array([baselines[r].get('std', baselines[r]['scale']) for r in self.regions], dtype=float) ** 2
+        self.count = np.minimum([int(baselines[r].get('count', 0)) for r in self.regions], self.max_count)
+        for i, region in enumerate(self.regions):
+            n = min(int(self.count[i]), len(self.recent))
+            if n == 0: continue
+            # Evenly spaced over +-a, the median is the centre and the MAD is
+            # a/2; ordered extremes-first so they are the first to be replaced
+            half_width = 2.0 * baselines[region]['scale'] / 1.4826
+            spread = half_width * ((2 * np.arange(n) + 1) / n - 1)
+            order = np.empty(n, dtype=int)
+            order[0::2] = np.arange((n + 1) // 2)
+            order[1::2] = n - 1 - np.arange(n // 2)
+            self.recent[:n, i] = baselines[region]['center'] + spread[order]
+            self.filled[i] = n
+            self.pos[i] = n % len(self.recent)
+
+    def ready(self, min_samples):
+        return len(self.regions) > 0 and self.filled.min() >= min_samples
+
+    def push(self, values):
+        # Regions missing from values (all channels rejected) are skipped
+        for i, region in enumerate(self.regions):
+            if region not in values:
+                continue
+            x = float(values[region])
+            self.count[i] += 1
+            n = min(self.count[i], self.max_count)
+            delta = x - self.mean[i]
+            self.mean[i] += delta / n
+            self.var[i] += (delta * (x - self.mean[i]) - self.var[i]) / n
+            self.recent[self.pos[i], i] = x
+            self.pos[i] = (self.pos[i] + 1) % len(self.recent)
+            self.filled[i] = min(self.filled[i] + 1, len(self.recent))
+
+    def baselines(self):
+        result = {}
+        for i, region in enumerate(self.regions):
+            recent = self.recent[:self.filled[i], i]
+            median = np.median(recent)
+            mad = 1.4826 * np.median(np.abs(recent - median))
+            std = np.sqrt(self.var[i])
+            scale = max(mad if mad > 0 else std, 1e-6 * abs(median) + 1e-12)
+            result[region] = {'center': float(median), 'scale': float(scale), 'mean': float(self.mean[i]),
+                              'std': float(std), 'count': int(min(self.count[i], self.max_count))}
+        return result
+
+def normalize_baselines(baselines):
+    # Older recordings stored one multiplier per region; a multiplier b is the
+    # z-score with centre 0 and scale b, so those keep their meaning.
+    return {region: b if isinstance(b, dict) else {'center': 0.0, 'scale': float(b)}
+            for region, b in (baselines or {}).items()}
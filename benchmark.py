@@ -0,0 +1,213 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import brainflow
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+from brainflow.data_filter import DataFilter
+
+from bci_pipeline import EXECUTION_MODES, METRICS, StageTimers, build_montage
+
+# --- Offline Benchmark ---
+# Runs the real ProcessingPipeline headless, as fast as possible, over EEG
+# captured from BrainFlow's synthetic board or loaded from a playback file.
+#
+#   py benchmark.py --output before.json
+#   py benchmark.py --playback session.csv --board-id 41 --output after.json --compare before.json
+
+def capture_synthetic(seconds):
+    board_id = BoardIds.SYNTHETIC_BOARD.value
+    BoardShim.disable_board_logger()
+    board = BoardShim(board_id, BrainFlowInputParams())
+    board.prepare_session()
+    try:
+        board.start_stream()
+        time.sleep(seconds)
+        data = board.get_board_data()
+        board.stop_stream()
+    finally:
+        board.release_session()
+    return data[BoardShim.get_eeg_channels(board_id)]
+
+def load_playback(path, board_id):
+    # Same file format BrainFlow's PLAYBACK_FILE_BOARD replays (DataFilter.write_file)
+    data = DataFilter.read_file(path)
+    return data[BoardShim.get_eeg_channels(board_id)]
+
+def run_config(source, num_channels, sampling_rate, window_seconds, refresh_rate_hz, duration_seconds, metric_mode, memory_ticks,
+               execution_mode='thread'):
+    # Tile the captured channels up to the requested count and treat the data
+    # as if it had been sampled at the requested rate.
+    eeg = np.tile(source, (int(np.ceil(num_channels / source.shape[0])), 1))[:num_channels]
+    chunk = max(1, int(round(sampling_rate / refresh_rate_hz)))
+    eeg_channels = list(range(num_channels))
+    num_ticks = int(duration_seconds * refresh_rate_hz)
+    warmup_ticks = int(np.ceil(window_seconds * refresh_rate_hz)) + 1
+
+    def chunks():
+        for start in itertools.count(0, chunk):
+            start %= eeg.shape[1]
+            block = eeg[:, start:start + chunk]
+            if block.shape[1] < chunk:
+                block = np.concatenate([block, eeg[:, :chunk - block.shape[1]]], axis=1)
+            yield block
+
+    def make_pipeline(timers):
+        montage = build_montage(eeg_channels, [str(ch) for ch in eeg_channels])
+        pipeline = EXECUTION_MODES[execution_mode](eeg_channels, sampling_rate, montage, window_seconds, timers)
+        source_chunks = chunks()
+        for _ in range(warmup_ticks):
+            pipeline.push(next(source_chunks))
+        pipeline.compute(metric_mode, 0.2, 0.0)  # also waits for a worker process to start
+        return pipeline, source_chunks
+
+    timers = StageTimers()
+    timers.enabled = True
+    pipeline, source_chunks = make_pipeline(timers)
+    latencies = np.empty(num_ticks)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for i in range(num_ticks):
+        block = next(source_chunks)
+        tick_start = time.perf_counter()
+        pipeline.push(block)
+        if pipeline.ready:
+            pipeline.compute(metric_mode, 0.2, i / refresh_rate_hz)
+        latencies[i] = time.perf_counter() - tick_start
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    pipeline.close()
+
+    # Memory is measured in a separate short pass; tracemalloc would skew the timings
+    tracemalloc.start()
+    pipeline, source_chunks = make_pipeline(StageTimers())
+    for i in range(memory_ticks):
+        pipeline.push(next(source_chunks))
+        if pipeline.ready:
+            pipeline.compute(metric_mode, 0.2, i / refresh_rate_hz)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pipeline.close()
+
+    latencies_ms = latencies * 1000.0
+    return {
+        'config': {
+            'channels': num_channels,
+            'sampling_rate': sampling_rate,
+            'window_seconds': window_seconds,
+            'refresh_rate_hz': refresh_rate_hz,
+            'metric_mode': metric_mode,
+            'execution_mode': execution_mode,
+        },
+        'ticks': num_ticks,
+        'wall_seconds': wall,
+        'realtime_factor': duration_seconds / wall if wall > 0 else float('inf'),
+        'samples_per_second': num_ticks * chunk * num_channels / wall if wall > 0 else float('inf'),
+        'cpu_utilisation': cpu / wall if wall > 0 else 0.0,
+        'tick_ms': {
+            'mean': float(latencies_ms.mean()),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+            'max': float(latencies_ms.max()),
+        },
+        'deadline_misses': int(np.sum(latencies > 1.0 / refresh_rate_hz)),
+        'peak_memory_kb': peak_bytes / 1024.0,
+        'stages': timers.stats(),
+    }
+
+def config_key(result):
+    config = result['config']
+    return tuple(config.get(k, 'thread') for k in ('channels', 'sampling_rate', 'window_seconds', 'refresh_rate_hz', 'metric_mode', 'execution_mode'))
+
+def compare(results, baseline, threshold):
+    # Returns True when any matching config got slower than the threshold allows
+    baseline_by_key = {config_key(r): r for r in baseline['results']}
+    regressed = False
+    print(f"\n{'config':<43} {'p50 ms':>16} {'p99 ms':>16} {'samples/s':>18}")
+    for result in results:
+        old = baseline_by_key.get(config_key(result))
+        if old is None: continue
+        changes = []
+        for new_value, old_value, higher_is_better in [
+            (result['tick_ms']['p50'], old['tick_ms']['p50'], False),
+            (result['tick_ms']['p99'], old['tick_ms']['p99'], False),
+            (result['samples_per_second'], old['samples_per_second'], True),
+        ]:
+            change = (new_value - old_value) / old_value * 100.0 if old_value else 0.0
+            if (change < -threshold) if higher_is_better else (change > threshold):
+                regressed = True
+            changes.append(f"{change:+7.1f}%")
+        label = 'ch={} fs={} win={} hz={} {} {}'.format(*config_key(result))
+        print(f"{label:<43} {changes[0]:>16} {changes[1]:>16} {changes[2]:>18}")
+    return regressed
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark for the BrainFlow Keyboard Control processing pipeline.')
+    parser.add_argument('--playback', help='BrainFlow data file to replay instead of capturing from the synthetic board')
+    parser.add_argument('--board-id', type=int, default=BoardIds.SYNTHETIC_BOARD.value, help='board the playback file was recorded from')
+    parser.add_argument('--capture-seconds', type=float, default=5.0, help='seconds of synthetic data to capture')
+    parser.add_argument('--channels', default='4,8,16,32')
+    parser.add_argument('--sampling-rates', default='250')
+    parser.add_argument('--windows', default='2')
+    parser.add_argument('--refresh-rates', default='5,20')
+    parser.add_argument('--metric-mode', default='alpha', choices=list(METRICS))
+    parser.add_argument('--execution-modes', default='thread', help='comma-separated: thread, process')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds of simulated data per configuration')
+    parser.add_argument('--memory-ticks', type=int, default=50)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='regression threshold in percent')
+    args = parser.parse_args()
+
+    if args.playback:
+        print(f"Loading playback file {args.playback} (board {args.board_id})...")
+        source = load_playback(args.playback, args.board_id)
+    else:
+        print(f"Capturing {args.capture_seconds:.0f} s from the synthetic board...")
+        source = capture_synthetic(args.capture_seconds)
+
+    results = []
+    for channels, sampling_rate, window_seconds, refresh_rate_hz, execution_mode in itertools.product(
+            parse_list(args.channels, int), parse_list(args.sampling_rates, int),
+            parse_list(args.windows, float), parse_list(args.refresh_rates, float),
+            parse_list(args.execution_modes, str)):
+        result = run_config(source, channels, sampling_rate, window_seconds, refresh_rate_hz,
+                            args.duration, args.metric_mode, args.memory_ticks, execution_mode)
+        results.append(result)
+        print(f"ch={channels:<3} fs={sampling_rate:<5} win={window_seconds:<4} hz={refresh_rate_hz:<5} {execution_mode:<7} "
+              f"p50={result['tick_ms']['p50']:.3f} ms p99={result['tick_ms']['p99']:.3f} ms "
+              f"x{result['realtime_factor']:.0f} realtime cpu={result['cpu_utilisation']:.0%} "
+              f"mem={result['peak_memory_kb']:.0f} KiB")
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'brainflow': getattr(brainflow, '__version__', 'unknown'),
+            'source': args.playback or 'synthetic',
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            print(f"\nRegression above {args.threshold:.0f}% detected.")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
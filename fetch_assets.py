@@ -0,0 +1,31 @@
+import os
+import urllib.request
+
+# --- Vendor Assets ---
+# Downloads the page's JavaScript libraries into static/vendor once, so the UI
+# loads with no network access afterwards. The server imports VENDOR_ASSETS
+# from here for its CDN fallback; this script imports nothing from the server,
+# so it runs on a headless machine.
+#
+#   py fetch_assets.py
+
+VENDOR_ASSETS = {
+    'chart.umd.min.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js',
+    'socket.io.min.js': 'https://cdn.jsdelivr.net/npm/socket.io-client@4.7.2/dist/socket.io.min.js',
+}
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'vendor')
+
+def main():
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    for filename, url in VENDOR_ASSETS.items():
+        path = os.path.join(VENDOR_DIR, filename)
+        print(f"Downloading {url}")
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f"  -> {path} ({len(data) // 1024} KiB)")
+
+if __name__ == '__main__':
+    main()
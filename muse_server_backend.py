@@ -1,565 +1,1603 @@
-import sys
-import threading
-import time
-import webbrowser
-import subprocess
-import os
-
-import numpy as np
-from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
-from brainflow.data_filter import DataFilter, FilterTypes, AggOperations, WindowOperations
-from flask import Flask, render_template_string
-from flask_socketio import SocketIO, emit
-from pynput.keyboard import Controller, Key
-
-# --- Basic Flask App and SocketIO Setup ---
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'secret!'
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-# --- Dynamic HTML Generation ---
-def generate_board_options():
-    options_html = ""
-    sorted_boards = sorted(BoardIds, key=lambda x: x.value)
-    for board in sorted_boards:
-        if 'SYNTHETIC' in board.name or 'PLAYBACK' in board.name:
-            continue
-        board_name = board.name.replace('_BOARD', '').replace('_', ' ').title()
-        selected_attr = 'selected' if board.value == 41 else ''
-        options_html += f'<option value="{board.value}" {selected_attr}>{board_name} (ID: {board.value})</option>\n'
-    return options_html
-
-# --- HTML Template ---
-HTML_TEMPLATE = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>BrainFlow Keyboard Control</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <style>
-        body {{ font-family: 'Inter', sans-serif; }}
-        .log-entry {{ font-family: 'Courier New', Courier, monospace; }}
-        :disabled {{ cursor: not-allowed; opacity: 0.6; }}
-        input[type=range]::-webkit-slider-thumb {{
-            -webkit-appearance: none; appearance: none; width: 20px; height: 20px;
-            background: #4f46e5; cursor: pointer; border-radius: 50%;
-        }}
-        input[type=range]::-moz-range-thumb {{
-            width: 20px; height: 20px; background: #4f46e5; cursor: pointer; border-radius: 50%;
-        }}
-        .quality-indicator {{
-            transition: opacity 0.5s ease-in-out;
-        }}
-    </style>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;700&display=swap" rel="stylesheet">
-</head>
-<body class="bg-gray-900 text-gray-200 flex items-center justify-center min-h-screen">
-    <div class="w-full max-w-lg bg-gray-800 rounded-2xl shadow-2xl p-6 md:p-8 m-4">
-        <h1 class="text-2xl font-bold text-center mb-6 text-indigo-400">BrainFlow Keyboard Control</h1>
-        <div class="border border-gray-700 rounded-lg p-4 mb-6">
-            <h2 class="text-lg font-semibold mb-3 text-gray-300">1. Connection</h2>
-            <div class="space-y-4">
-                <select id="boardIdSelect" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg focus:ring-indigo-500 focus:border-indigo-500 block w-full p-2.5">
-                    {generate_board_options()}
-                </select>
-                <div>
-                    <label for="macAddressInput" class="block mb-2 text-sm font-medium">MAC Address / Device Name</label>
-                    <input type="text" id="macAddressInput" placeholder="Optional: e.g., 00:11:22:33:FF:EE" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-full p-2.5">
-                </div>
-                <div>
-                    <label for="timeoutInput" class="block mb-2 text-sm font-medium">Connection Timeout (seconds)</label>
-                    <input type="number" id="timeoutInput" value="20" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-full p-2.5">
-                </div>
-                <button id="connectBtn" class="w-full bg-indigo-600 hover:bg-indigo-700 text-white font-bold py-3 px-4 rounded-lg transition-colors duration-200 focus:outline-none focus:ring-2 focus:ring-indigo-500">
-                    Connect
-                </button>
-                <div class="flex justify-between items-center">
-                    <div class="text-center font-semibold text-lg" id="statusLabel">Status: Disconnected</div>
-                    <div id="qualityIndicator" class="quality-indicator text-yellow-400 font-bold opacity-0">POOR SIGNAL</div>
-                </div>
-            </div>
-        </div>
-        <div class="border border-gray-700 rounded-lg p-4 mb-6">
-            <h2 class="text-lg font-semibold mb-3 text-gray-300">2. Calibration</h2>
-            <div class="space-y-4">
-                <button id="calibrateBtn" class="w-full bg-cyan-600 hover:bg-cyan-700 text-white font-bold py-3 px-4 rounded-lg transition-colors duration-200 focus:outline-none focus:ring-2 focus:ring-cyan-500" disabled>
-                    Calibrate (Connect First)
-                </button>
-                 <div class="text-center text-sm" id="calibrationStatus"></div>
-            </div>
-        </div>
-        <div class="border border-gray-700 rounded-lg p-4 mb-6">
-            <h2 class="text-lg font-semibold mb-3 text-gray-300">3. Settings</h2>
-            <div class="space-y-4">
-                 <div>
-                    <label for="metricModeSelect" class="block mb-2 text-sm font-medium">Metric Mode</label>
-                    <select id="metricModeSelect" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg focus:ring-indigo-500 focus:border-indigo-500 block w-full p-2.5">
-                        <option value="focus">Focus Ratio (Beta/Alpha)</option>
-                        <option value="alpha" selected>Alpha Power (Relaxation)</option>
-                    </select>
-                </div>
-                <div>
-                    <label for="smoothingSlider" class="block mb-2 text-sm font-medium">Smoothing Factor (<span id="smoothingValue">0.2</span>)</label>
-                    <input id="smoothingSlider" type="range" min="0.01" max="1.0" value="0.2" step="0.01" class="w-full h-2 bg-gray-700 rounded-lg appearance-none cursor-pointer">
-                </div>
-                <div>
-                    <label for="sensitivitySlider" class="block mb-2 text-sm font-medium">Activation Threshold (<span id="sensitivityValue">2.0</span>x Baseline)</label>
-                    <input id="sensitivitySlider" type="range" min="1.1" max="5.0" value="2.0" step="0.1" class="w-full h-2 bg-gray-700 rounded-lg appearance-none cursor-pointer">
-                </div>
-                <hr class="border-gray-600">
-                <div id="keyBindingsContainer" class="space-y-3">
-                    <label class="block mb-2 text-sm font-medium">Key Bindings for Left/Right States</label>
-                    <div class="flex items-center space-x-2">
-                        <label for="key-left" class="w-1/3 text-sm font-medium">Left Side:</label>
-                        <input type="text" id="key-left" data-state="left" class="key-binding-input bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-2/3 p-2.5" placeholder="e.g., left">
-                    </div>
-                    <div class="flex items-center space-x-2">
-                        <label for="key-right" class="w-1/3 text-sm font-medium">Right Side:</label>
-                        <input type="text" id="key-right" data-state="right" class="key-binding-input bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-2/3 p-2.5" placeholder="e.g., right">
-                    </div>
-                </div>
-            </div>
-        </div>
-        <div class="border border-gray-700 rounded-lg p-4 mb-6">
-            <h2 class="text-lg font-semibold mb-3 text-gray-300">Live Metrics</h2>
-            <canvas id="metricChart"></canvas>
-        </div>
-        <div class="border border-gray-700 rounded-lg p-4">
-            <h2 class="text-lg font-semibold mb-3 text-gray-300">Event Log</h2>
-            <div id="logArea" class="h-40 bg-gray-900 rounded-md p-3 overflow-y-auto text-sm log-entry space-y-1"></div>
-        </div>
-    </div>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/socket.io-client@4.7.2/dist/socket.io.min.js"></script>
-    <script>
-        document.addEventListener('DOMContentLoaded', () => {{
-            const socket = io('http://127.0.0.1:5000');
-            let metricChart;
-            const metricData = {{
-                labels: [],
-                datasets: [
-                    {{ label: 'Left', data: [], borderColor: '#f87171', borderWidth: 2, pointRadius: 0, tension: 0.4 }},
-                    {{ label: 'Right', data: [], borderColor: '#60a5fa', borderWidth: 2, pointRadius: 0, tension: 0.4 }}
-                ]
-            }};
-
-            const connectBtn = document.getElementById('connectBtn');
-            const statusLabel = document.getElementById('statusLabel');
-            const sensitivitySlider = document.getElementById('sensitivitySlider');
-            const sensitivityValue = document.getElementById('sensitivityValue');
-            const boardIdSelect = document.getElementById('boardIdSelect');
-            const macAddressInput = document.getElementById('macAddressInput');
-            const timeoutInput = document.getElementById('timeoutInput');
-            const logArea = document.getElementById('logArea');
-            const calibrateBtn = document.getElementById('calibrateBtn');
-            const calibrationStatus = document.getElementById('calibrationStatus');
-            const metricModeSelect = document.getElementById('metricModeSelect');
-            const smoothingSlider = document.getElementById('smoothingSlider');
-            const smoothingValue = document.getElementById('smoothingValue');
-            const qualityIndicator = document.getElementById('qualityIndicator');
-
-            const createChart = () => {{
-                const ctx = document.getElementById('metricChart').getContext('2d');
-                metricChart = new Chart(ctx, {{
-                    type: 'line',
-                    data: metricData,
-                    options: {{
-                        animation: false,
-                        scales: {{ y: {{ beginAtZero: true, grid: {{ color: 'rgba(255, 255, 255, 0.1)' }}, ticks: {{ color: '#9ca3af' }} }}, x: {{ display: false }} }},
-                        plugins: {{ legend: {{ display: true, labels: {{ color: '#9ca3af' }} }} }}
-                    }}
-                }});
-            }};
-
-            const log = (message) => {{
-                const time = new Date().toLocaleTimeString();
-                logArea.innerHTML += `<div class="log-entry"><span class="text-gray-500">${{time}}:</span> <span class="text-gray-300">${{message}}</span></div>`;
-                logArea.scrollTop = logArea.scrollHeight;
-            }};
-            
-            socket.on('connect', () => log('Successfully connected to Python server.'));
-            socket.on('log_message', (msg) => log(msg));
-
-            socket.on('connection_status', (data) => {{
-                const isStreaming = data.status === 'streaming';
-                statusLabel.textContent = `Status: ${{isStreaming ? 'Streaming' : 'Disconnected'}}`;
-                statusLabel.className = `text-center font-semibold text-lg ${{isStreaming ? 'text-green-400' : 'text-red-400'}}`;
-                connectBtn.textContent = isStreaming ? 'Disconnect' : 'Connect';
-                connectBtn.classList.toggle('bg-indigo-600', !isStreaming);
-                connectBtn.classList.toggle('bg-red-600', isStreaming);
-                calibrateBtn.disabled = !isStreaming;
-                calibrateBtn.textContent = isStreaming ? 'Calibrate' : 'Calibrate (Connect First)';
-                if (!isStreaming) calibrationStatus.textContent = '';
-            }});
-
-            socket.on('calibration_status', (data) => {{
-                if (data.status === 'calibrating') {{
-                    calibrationStatus.textContent = `Calibrating... Please relax. ${{data.countdown}}s remaining.`;
-                    calibrateBtn.disabled = true;
-                }} else if (data.status === 'complete') {{
-                    calibrationStatus.textContent = `Calibration Complete! Baselines: L:${{data.baselines.left.toFixed(2)}}, R:${{data.baselines.right.toFixed(2)}}`;
-                    calibrateBtn.disabled = false;
-                }}
-            }});
-            
-            let qualityTimeout;
-            socket.on('signal_quality', (data) => {{
-                if (data.quality === 'bad') {{
-                    qualityIndicator.style.opacity = 1;
-                    clearTimeout(qualityTimeout);
-                    qualityTimeout = setTimeout(() => {{
-                        qualityIndicator.style.opacity = 0;
-                    }}, 1500);
-                }}
-            }});
-
-            socket.on('metric_data', (data) => {{
-                if (!metricChart) return;
-                const datasets = metricChart.data.datasets;
-                datasets[0].data.push(data.left_value);
-                datasets[1].data.push(data.right_value);
-                metricChart.data.labels.push('');
-
-                while (datasets[0].data.length > 100) {{
-                    datasets.forEach(d => d.data.shift());
-                    metricChart.data.labels.shift();
-                }}
-                metricChart.update();
-            }});
-            
-            connectBtn.addEventListener('click', () => {{
-                if (connectBtn.textContent === 'Disconnect') {{
-                    socket.emit('stop_stream');
-                }} else {{
-                    socket.emit('start_stream', {{ 
-                        board_id: boardIdSelect.value,
-                        mac_address: macAddressInput.value,
-                        timeout: timeoutInput.value
-                    }});
-                }}
-            }});
-
-            calibrateBtn.addEventListener('click', () => {{
-                socket.emit('start_calibration');
-            }});
-            
-            const sendSettings = () => {{
-                const keyBindings = {{}};
-                document.querySelectorAll('.key-binding-input').forEach(input => {{
-                    keyBindings[input.dataset.state] = input.value;
-                }});
-
-                socket.emit('update_settings', {{
-                    sensitivity: sensitivitySlider.value,
-                    key_bindings: keyBindings,
-                    metric_mode: metricModeSelect.value,
-                    smoothing: smoothingSlider.value,
-                }});
-            }};
-            
-            sensitivitySlider.addEventListener('input', (e) => {{
-                sensitivityValue.textContent = parseFloat(e.target.value).toFixed(1);
-            }});
-            smoothingSlider.addEventListener('input', (e) => {{
-                smoothingValue.textContent = parseFloat(e.target.value).toFixed(2);
-            }});
-
-            sensitivitySlider.addEventListener('change', sendSettings);
-            smoothingSlider.addEventListener('change', sendSettings);
-            
-            document.querySelectorAll('.key-binding-input').forEach(input => {{
-                input.addEventListener('change', sendSettings);
-            }});
-
-            metricModeSelect.addEventListener('change', sendSettings);
-
-            createChart();
-        }});
-    </script>
-</body>
-</html>
-"""
-
-# --- Global state management ---
-class BCIState:
-    def __init__(self):
-        self.board = None
-        self.is_streaming = False
-        self.is_calibrating = False
-        self.eeg_channels = []
-        self.last_detection_times = {}
-        self.cooldown_s = 1.0 
-        self.params = BrainFlowInputParams()
-        self.keyboard = Controller()
-        self.board_id = 41
-        self.sensitivity = 2.0 
-        self.key_bindings = {}
-        self.baselines = {'left': 1.0, 'right': 1.0}
-        self.channel_map = {}
-        self.metric_mode = 'alpha'
-        self.smoothing_factor = 0.2
-        self.metric_emas = {'left': 0.0, 'right': 0.0}
-
-bci_state = BCIState()
-
-def get_lr_channel_map(eeg_channels):
-    sorted_channels = sorted(eeg_channels)
-    midpoint = len(sorted_channels) // 2
-    left_channels = sorted_channels[:midpoint]
-    right_channels = sorted_channels[midpoint:]
-    if len(sorted_channels) % 2 != 0:
-        right_channels.insert(0, sorted_channels[midpoint])
-    if not left_channels: left_channels = right_channels
-    if not right_channels: right_channels = left_channels
-    return {'left': left_channels, 'right': right_channels}
-
-# --- Backend Data Processing Thread ---
-def data_processing_thread():
-    sampling_rate = BoardShim.get_sampling_rate(bci_state.board_id)
-    window_seconds = 2
-    refresh_rate_hz = 5
-    nfft = DataFilter.get_nearest_power_of_two(sampling_rate)
-    num_samples_in_window = int(sampling_rate * window_seconds)
-    
-    bci_state.channel_map = get_lr_channel_map(bci_state.eeg_channels)
-    print(f"Using dynamically generated channel map: {bci_state.channel_map}")
-    
-    while bci_state.is_streaming:
-        start_time = time.time()
-        try:
-            data = bci_state.board.get_current_board_data(num_samples_in_window)
-            if data.shape[1] < num_samples_in_window:
-                time.sleep(1.0 / refresh_rate_hz)
-                continue
-            
-            max_std = 0
-            for c in bci_state.eeg_channels:
-                std = np.std(data[c])
-                if std > max_std:
-                    max_std = std
-            if max_std > 100:
-                socketio.emit('signal_quality', {'quality': 'bad'})
-
-
-            metric_values = {}
-            for region, channels in bci_state.channel_map.items():
-                if not channels: continue
-                regional_metric_vals = []
-                for ch_index in channels:
-                    channel_data = np.copy(data[ch_index])
-                    # Perform calculations on raw data to avoid filtering issues
-                    
-                    psd = DataFilter.get_psd_welch(channel_data, nfft, nfft // 2, sampling_rate, WindowOperations.HANNING.value)
-                    
-                    if bci_state.metric_mode == 'alpha':
-                        alpha_power = DataFilter.get_band_power(psd, 7.0, 13.0)
-                        regional_metric_vals.append(alpha_power)
-                    else: # 'focus'
-                        alpha = DataFilter.get_band_power(psd, 7.0, 13.0)
-                        beta = DataFilter.get_band_power(psd, 13.0, 30.0)
-                        if alpha > 0.001:
-                            focus = beta / alpha
-                            regional_metric_vals.append(focus)
-                metric_values[region] = np.mean(regional_metric_vals) if regional_metric_vals else 0.0
-
-            alpha = bci_state.smoothing_factor
-            for region in ['left', 'right']:
-                raw_value = metric_values.get(region, 0)
-                bci_state.metric_emas[region] = (alpha * raw_value) + (1 - alpha) * bci_state.metric_emas[region]
-
-            if not bci_state.is_calibrating:
-                 print(f"Smoothed Metrics ({bci_state.metric_mode}): L={bci_state.metric_emas.get('left',0):.2f}, R={bci_state.metric_emas.get('right',0):.2f}")
-
-            socketio.emit('metric_data', {
-                'left_value': bci_state.metric_emas.get('left', 0),
-                'right_value': bci_state.metric_emas.get('right', 0),
-            })
-
-            if not bci_state.is_calibrating:
-                check_metric_triggers(bci_state.metric_emas)
-            
-            execution_time = time.time() - start_time
-            sleep_time = (1.0 / refresh_rate_hz) - execution_time
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-        except Exception as e:
-            print(f"Error in data thread: {e}")
-            break
-    print("Data thread stopped.")
-
-def check_metric_triggers(metrics):
-    sensitivity = bci_state.sensitivity
-    left = metrics.get('left', 0)
-    right = metrics.get('right', 0)
-
-    if left > bci_state.baselines['left'] * sensitivity and left > right: 
-        trigger_key_press('left')
-    elif right > bci_state.baselines['right'] * sensitivity and right > left: 
-        trigger_key_press('right')
-
-
-def trigger_key_press(focus_state):
-    # This function is correct and does not need changes
-    current_time = time.time()
-    last_time = bci_state.last_detection_times.get(focus_state, 0)
-    if (current_time - last_time) < bci_state.cooldown_s:
-        return
-    bci_state.last_detection_times[focus_state] = current_time
-    key_str = bci_state.key_bindings.get(focus_state, '').lower().strip()
-    if not key_str:
-        return
-    print(f"State Detected: '{focus_state.upper()}'. Pressing '{key_str}'.")
-    socketio.emit('log_message', f"State Detected: '{focus_state.upper()}'. Pressing '{key_str}'.")
-    try:
-        key_map = {
-            'space': Key.space, 'enter': Key.enter, 'esc': Key.esc, 'up': Key.up, 'down': Key.down, 'left': Key.left, 'right': Key.right,
-            'shift': Key.shift, 'ctrl': Key.ctrl, 'alt': Key.alt, 'win': Key.cmd, 'cmd': Key.cmd,
-            'tab': Key.tab, 'caps_lock': Key.caps_lock, 'delete': Key.delete,
-            'f1': Key.f1, 'f2': Key.f2, 'f3': Key.f3, 'f4': Key.f4, 'f5': Key.f5, 'f6': Key.f6, 'f7': Key.f7, 'f8': Key.f8, 'f9': Key.f9, 'f10': Key.f10, 'f11': Key.f11, 'f12': Key.f12,
-            'page_up': Key.page_up, 'pgup': Key.page_up, 'page_down': Key.page_down, 'pgdn': Key.page_down,
-            'home': Key.home, 'end': Key.end, 'insert': Key.insert
-        }
-        keys = [k.strip() for k in key_str.split('+')]
-        parsed_keys = [key_map.get(k, k) for k in keys if len(k) == 1 or k in key_map]
-        if not parsed_keys: raise ValueError("No valid keys found.")
-        if len(parsed_keys) > 1:
-            modifiers = parsed_keys[:-1]
-            primary_key = parsed_keys[-1]
-            for mod in modifiers: bci_state.keyboard.press(mod)
-            bci_state.keyboard.press(primary_key); bci_state.keyboard.release(primary_key)
-            for mod in reversed(modifiers): bci_state.keyboard.release(mod)
-        else:
-            bci_state.keyboard.press(parsed_keys[0]); bci_state.keyboard.release(parsed_keys[0])
-    except Exception as e:
-        print(f"Error pressing key '{key_str}': {repr(e)}")
-        socketio.emit('log_message', f"Error pressing key '{key_str}': {repr(e)}")
-
-
-def calibration_thread():
-    bci_state.is_calibrating = True
-    calibration_seconds = 10
-    refresh_rate_hz = 5
-    calibration_data = {direction: [] for direction in ['left', 'right']}
-    
-    for i in range(calibration_seconds * refresh_rate_hz):
-        countdown = calibration_seconds - (i // refresh_rate_hz)
-        socketio.emit('calibration_status', {'status': 'calibrating', 'countdown': countdown})
-        
-        sampling_rate = BoardShim.get_sampling_rate(bci_state.board_id)
-        nfft = DataFilter.get_nearest_power_of_two(sampling_rate)
-        data = bci_state.board.get_current_board_data(int(sampling_rate * 2))
-
-        for region, channels in bci_state.channel_map.items():
-            if not channels: continue
-            regional_metric_vals = []
-            for ch_index in channels:
-                if ch_index < data.shape[0]:
-                    channel_data = np.copy(data[ch_index])
-                    psd = DataFilter.get_psd_welch(channel_data, nfft, nfft // 2, sampling_rate, WindowOperations.HANNING.value)
-                    if bci_state.metric_mode == 'alpha':
-                        alpha_power = DataFilter.get_band_power(psd, 7.0, 13.0)
-                        regional_metric_vals.append(alpha_power)
-                    else: # 'focus'
-                        alpha = DataFilter.get_band_power(psd, 7.0, 13.0)
-                        beta = DataFilter.get_band_power(psd, 13.0, 30.0)
-                        if alpha > 0.001:
-                            focus = beta / alpha
-                            regional_metric_vals.append(focus)
-            if regional_metric_vals:
-                calibration_data[region].append(np.mean(regional_metric_vals))
-        time.sleep(1.0 / refresh_rate_hz)
-
-    for region, values in calibration_data.items():
-        bci_state.baselines[region] = np.mean(values) if values else 1.0
-            
-    bci_state.is_calibrating = False
-    print(f"Calibration complete. Baselines: {bci_state.baselines}")
-    socketio.emit('calibration_status', {'status': 'complete', 'baselines': bci_state.baselines})
-
-
-# --- SocketIO Event Handlers ---
-@socketio.on('start_stream')
-def handle_start_stream(data):
-    if bci_state.is_streaming:
-        emit('log_message', 'Stream is already running.')
-        return
-    try:
-        bci_state.board_id = int(data['board_id'])
-        bci_state.params = BrainFlowInputParams()
-        mac_address = data.get('mac_address', '')
-        timeout = data.get('timeout', '20')
-        
-        if mac_address: bci_state.params.mac_address = mac_address
-        try:
-            bci_state.params.timeout = int(timeout)
-        except (ValueError, TypeError):
-            bci_state.params.timeout = 20
-        
-        print(f"Attempting to connect to board ID: {bci_state.board_id} with mac: '{mac_address}', timeout: {bci_state.params.timeout}")
-        emit('log_message', f"Initializing board ID: {bci_state.board_id}...")
-        
-        BoardShim.enable_dev_board_logger()
-        bci_state.board = BoardShim(bci_state.board_id, bci_state.params)
-        bci_state.board.prepare_session()
-        bci_state.board.start_stream(450000)
-        bci_state.is_streaming = True
-        bci_state.metric_emas = {'left': 0.0, 'right': 0.0} # Reset EMAs
-        
-        socketio.emit('log_message', 'Connection successful. Filling buffer...')
-        time.sleep(3) 
-
-        bci_state.eeg_channels = BoardShim.get_eeg_channels(bci_state.board_id)
-        emit('connection_status', {'status': 'streaming'})
-        emit('log_message', 'Buffer filled. Ready for calibration.')
-        threading.Thread(target=data_processing_thread, daemon=True).start()
-    except Exception as e:
-        print(f"Connection Error: {e}")
-        emit('log_message', f"Error: {e}")
-        bci_state.is_streaming = False
-        emit('connection_status', {'status': 'disconnected'})
-
-@socketio.on('start_calibration')
-def handle_start_calibration():
-    if bci_state.is_streaming and not bci_state.is_calibrating:
-        threading.Thread(target=calibration_thread, daemon=True).start()
-
-@socketio.on('stop_stream')
-def handle_stop_stream():
-    if bci_state.board and bci_state.is_streaming:
-        bci_state.board.stop_stream()
-        bci_state.board.release_session()
-    bci_state.is_streaming = False; bci_state.board = None
-    print("Streaming stopped.")
-    emit('log_message', 'Stream stopped.'); emit('connection_status', {'status': 'disconnected'})
-
-@socketio.on('update_settings')
-def handle_update_settings(data):
-    print(f"Updating settings: {data}")
-    bci_state.sensitivity = float(data.get('sensitivity', bci_state.sensitivity))
-    bci_state.key_bindings = data.get('key_bindings', bci_state.key_bindings)
-    bci_state.metric_mode = data.get('metric_mode', bci_state.metric_mode)
-    bci_state.smoothing_factor = float(data.get('smoothing', bci_state.smoothing_factor))
-    if 'thresholds' in data:
-        for direction, value in data['thresholds'].items():
-            bci_state.thresholds[direction] = float(value)
-    emit('log_message', "Settings updated.")
-
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
-
-if __name__ == '__main__':
-    try:
-        import flask, flask_socketio, pynput, numpy, brainflow
-    except ImportError:
-        print("Missing dependencies. Please run: pip install Flask Flask-SocketIO pynput numpy brainflow")
-        sys.exit(1)
-
-    print("Starting BrainFlow BCI Server...")
-    webbrowser.open_new_tab('http://127.0.0.1:5000')
-    socketio.run(app, host='127.0.0.1', port=5000)
-
+import sys
+import threading
+import time
+import webbrowser
+import subprocess
+import os
+import queue
+import collections
+import json
+import re
+import hashlib
+import importlib.metadata
+
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+from brainflow.data_filter import FilterTypes, AggOperations
+from flask import Flask, request, jsonify, Response
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from pynput.keyboard import Controller, Key
+
+from bci_pipeline import (BANDS, DECISION_ACTIONS, DEFAULT_DECISION, DEFAULT_FILTERS, EXECUTION_MODES, METRICS,
+                          DecisionEngine, Metric, ProcessingPipeline, RunningStats, SessionRecorder, StageTimers,
+                          build_montage, parse_filter_settings, parse_montage_layout)
+from fetch_assets import VENDOR_ASSETS
+
+# --- Basic Flask App and SocketIO Setup ---
+app = Flask(__name__)
+app.config['SECRET_KEY'] = 'secret!'
+socketio = SocketIO(app, cors_allowed_origins="*")
+
+# --- Board Index ---
+# Board descriptors are parsed once per BrainFlow release and cached on disk,
+# so startup and stream setup never walk BoardIds or re-parse descriptors.
+BOARD_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'board_index.json')
+
+def build_board_index():
+    boards = {}
+    for board in sorted(BoardIds, key=lambda x: x.value):
+        try:
+            descr = BoardShim.get_board_descr(board.value)
+        except Exception:
+            continue
+        if 'sampling_rate' not in descr:
+            continue  # streaming/playback boards take their layout from a master board
+        eeg_channels = descr.get('eeg_channels', [])
+        eeg_names = descr.get('eeg_names', '')
+        boards[str(board.value)] = {
+            'name': board.name.replace('_BOARD', '').replace('_', ' ').title(),
+            'enum_name': board.name,
+            'sampling_rate': descr['sampling_rate'],
+            'num_rows': descr['num_rows'],
+            'timestamp_channel': descr['timestamp_channel'],
+            'eeg_channels': eeg_channels,
+            'eeg_names': eeg_names.split(',') if eeg_names else [str(ch) for ch in eeg_channels],
+        }
+    return boards
+
+def load_board_index(path=BOARD_INDEX_PATH):
+    version = importlib.metadata.version('brainflow')
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached.get('brainflow') == version:
+            return {int(k): v for k, v in cached['boards'].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+    boards = build_board_index()
+    try:
+        with open(path, 'w') as f:
+            json.dump({'brainflow': version, 'boards': boards}, f)
+    except OSError as e:
+        print(f"Could not cache board index: {e}")
+    return {int(k): v for k, v in boards.items()}
+
+BOARD_INDEX = load_board_index()
+
+def board_info(board_id):
+    return BOARD_INDEX[board_id]
+
+def generate_board_options():
+    options_html = ""
+    for board_id, board in BOARD_INDEX.items():
+        if 'SYNTHETIC' in board['enum_name'] or 'PLAYBACK' in board['enum_name']:
+            continue
+        selected_attr = 'selected' if board_id == 41 else ''
+        options_html += f'<option value="{board_id}" {selected_attr}>{board["name"]} (ID: {board_id})</option>\n'
+    return options_html
+
+def generate_metric_options(selected='alpha'):
+    return '\n'.join(f'<option value="{m.name}"{" selected" if m.name == selected else ""}>{m.label}</option>'
+                     for m in METRICS.values())
+
+def generate_view_options():
+    # Live Metrics views: the regional EMAs, or per-channel power in one band or all of them
+    views = [('regions', 'Regions'), ('all', 'Channels: total power')] + [(b, f'Channels: {b}') for b in BANDS]
+    return '\n'.join(f'<option value="{value}">{label}</option>' for value, label in views)
+
+# --- HTML Template ---
+def render_index_page():
+    return f"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>BrainFlow Keyboard Control</title>
+    <link rel="stylesheet" href="/static/app.css">
+</head>
+<body class="bg-gray-900 text-gray-200 flex items-center justify-center min-h-screen">
+    <div class="w-full max-w-lg bg-gray-800 rounded-2xl shadow-2xl p-6 md:p-8 m-4">
+        <h1 class="text-2xl font-bold text-center mb-6 text-indigo-400">BrainFlow Keyboard Control</h1>
+        <div class="border border-gray-700 rounded-lg p-4 mb-6">
+            <h2 class="text-lg font-semibold mb-3 text-gray-300">1. Connection</h2>
+            <div class="space-y-4">
+                <div>
+                    <label for="sessionInput" class="block mb-2 text-sm font-medium">Session</label>
+                    <input type="text" id="sessionInput" value="default" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-full p-2.5">
+                </div>
+                <div>
+                    <label for="userInput" class="block mb-2 text-sm font-medium">User (calibration profile)</label>
+                    <input type="text" id="userInput" value="default" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-full p-2.5">
+                </div>
+                <select id="boardIdSelect" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg focus:ring-indigo-500 focus:border-indigo-500 block w-full p-2.5">
+                    {generate_board_options()}
+                </select>
+                <div>
+                    <label for="macAddressInput" class="block mb-2 text-sm font-medium">MAC Address / Device Name</label>
+                    <input type="text" id="macAddressInput" placeholder="Optional: e.g., 00:11:22:33:FF:EE" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-full p-2.5">
+                </div>
+                <div>
+                    <label for="timeoutInput" class="block mb-2 text-sm font-medium">Connection Timeout (seconds)</label>
+                    <input type="number" id="timeoutInput" value="20" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-full p-2.5">
+                </div>
+                <div>
+                    <label for="executionModeSelect" class="block mb-2 text-sm font-medium">Signal Processing</label>
+                    <select id="executionModeSelect" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-full p-2.5">
+                        <option value="thread" selected>In server process</option>
+                        <option value="process">Separate worker process (many channels / sessions)</option>
+                    </select>
+                </div>
+                <label class="flex items-center text-sm font-medium"><input type="checkbox" id="recordToggle" class="mr-2">Record session to disk</label>
+                <button id="connectBtn" class="w-full bg-indigo-600 hover:bg-indigo-700 text-white font-bold py-3 px-4 rounded-lg transition-colors duration-200 focus:outline-none focus:ring-2 focus:ring-indigo-500">
+                    Connect
+                </button>
+                <div class="flex justify-between items-center">
+                    <div class="text-center font-semibold text-lg" id="statusLabel">Status: Disconnected</div>
+                    <div id="qualityIndicator" class="quality-indicator text-yellow-400 font-bold opacity-0">POOR SIGNAL</div>
+                </div>
+            </div>
+        </div>
+        <div class="border border-gray-700 rounded-lg p-4 mb-6">
+            <h2 class="text-lg font-semibold mb-3 text-gray-300">2. Calibration</h2>
+            <div class="space-y-4">
+                <button id="calibrateBtn" class="w-full bg-cyan-600 hover:bg-cyan-700 text-white font-bold py-3 px-4 rounded-lg transition-colors duration-200 focus:outline-none focus:ring-2 focus:ring-cyan-500" disabled>
+                    Calibrate (Connect First)
+                </button>
+                 <div class="text-center text-sm" id="calibrationStatus"></div>
+                <label class="flex items-center text-sm font-medium"><input type="checkbox" id="adaptiveToggle" class="mr-2">Keep adapting the baseline during use</label>
+            </div>
+        </div>
+        <div class="border border-gray-700 rounded-lg p-4 mb-6">
+            <h2 class="text-lg font-semibold mb-3 text-gray-300">3. Settings</h2>
+            <div class="space-y-4">
+                 <div>
+                    <label for="metricModeSelect" class="block mb-2 text-sm font-medium">Metric Mode</label>
+                    <select id="metricModeSelect" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg focus:ring-indigo-500 focus:border-indigo-500 block w-full p-2.5">
+                        {generate_metric_options()}
+                    </select>
+                </div>
+                <div>
+                    <label for="smoothingSlider" class="block mb-2 text-sm font-medium">Smoothing Factor (<span id="smoothingValue">0.2</span>)</label>
+                    <input id="smoothingSlider" type="range" min="0.01" max="1.0" value="0.2" step="0.01" class="w-full h-2 bg-gray-700 rounded-lg appearance-none cursor-pointer">
+                </div>
+                <div>
+                    <label for="sensitivitySlider" class="block mb-2 text-sm font-medium">Activation Threshold (<span id="sensitivityValue">2.0</span> SD above baseline)</label>
+                    <input id="sensitivitySlider" type="range" min="0.5" max="5.0" value="2.0" step="0.1" class="w-full h-2 bg-gray-700 rounded-lg appearance-none cursor-pointer">
+                </div>
+                <div>
+                    <label for="dwellSlider" class="block mb-2 text-sm font-medium">Dwell Time (<span id="dwellValue">200</span> ms above threshold)</label>
+                    <input id="dwellSlider" type="range" min="0" max="1000" value="200" step="50" class="w-full h-2 bg-gray-700 rounded-lg appearance-none cursor-pointer">
+                </div>
+                <div>
+                    <label for="keyActionSelect" class="block mb-2 text-sm font-medium">Key Action</label>
+                    <select id="keyActionSelect" class="bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg focus:ring-indigo-500 focus:border-indigo-500 block w-full p-2.5">
+                        <option value="tap" selected>Tap once per activation</option>
+                        <option value="hold">Hold while the state lasts</option>
+                    </select>
+                </div>
+                <hr class="border-gray-600">
+                <div id="keyBindingsContainer" class="space-y-3">
+                    <label class="block mb-2 text-sm font-medium">Key Bindings per Region</label>
+                    <div class="flex items-center space-x-2">
+                        <label for="key-left" class="w-1/3 text-sm font-medium">Left Side:</label>
+                        <input type="text" id="key-left" data-state="left" class="key-binding-input bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-2/3 p-2.5" placeholder="e.g., left">
+                    </div>
+                    <div class="flex items-center space-x-2">
+                        <label for="key-right" class="w-1/3 text-sm font-medium">Right Side:</label>
+                        <input type="text" id="key-right" data-state="right" class="key-binding-input bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-2/3 p-2.5" placeholder="e.g., right">
+                    </div>
+                </div>
+            </div>
+        </div>
+        <div class="border border-gray-700 rounded-lg p-4 mb-6">
+            <div class="flex justify-between items-center mb-3">
+                <h2 class="text-lg font-semibold text-gray-300">Live Metrics</h2>
+                <select id="viewSelect" class="bg-gray-700 border border-gray-600 text-gray-200 text-xs rounded-lg p-2">
+                    {generate_view_options()}
+                </select>
+            </div>
+            <div id="regionView"><canvas id="metricChart"></canvas></div>
+            <canvas id="channelCanvas" class="w-full hidden"></canvas>
+            <div id="schedulerStats" class="text-xs text-gray-500 mt-2"></div>
+            <div id="bufferStats" class="text-xs text-gray-500 mt-1"></div>
+            <div id="decisionStats" class="text-xs text-gray-500 mt-1"></div>
+            <div class="flex justify-between items-center text-xs text-gray-400 mt-2">
+                <label><input type="checkbox" id="profilingToggle" class="mr-1">Stage timing</label>
+                <a id="profileLink" href="/profile?seconds=5&session=default" class="text-indigo-400 hover:underline">Download 5 s profile</a>
+            </div>
+            <pre id="stageStats" class="text-xs text-gray-500 mt-2"></pre>
+        </div>
+        <div class="border border-gray-700 rounded-lg p-4">
+            <h2 class="text-lg font-semibold mb-3 text-gray-300">Event Log</h2>
+            <div id="logArea" class="h-40 bg-gray-900 rounded-md p-3 overflow-y-auto text-sm log-entry"></div>
+        </div>
+    </div>
+    <script src="/static/vendor/chart.umd.min.js"></script>
+    <script src="/static/vendor/socket.io.min.js"></script>
+    <script>
+        // Fall back to the CDN when fetch_assets.py has not been run yet
+        if (!window.Chart) document.write('<script src="{VENDOR_ASSETS['chart.umd.min.js']}"><\\/script>');
+        if (!window.io) document.write('<script src="{VENDOR_ASSETS['socket.io.min.js']}"><\\/script>');
+    </script>
+    <script>
+        document.addEventListener('DOMContentLoaded', () => {{
+            const socket = io('http://127.0.0.1:5000');
+            let metricChart;
+            const regionColors = ['#f87171', '#60a5fa', '#34d399', '#fbbf24', '#a78bfa', '#f472b6'];
+            // Live history is kept in fixed-size Float32Array rings. Frames only copy
+            // rows in; drawing happens at most once per animation frame, however
+            // fast frames arrive.
+            const HISTORY = 100;
+            const makeRing = (width) => ({{ width, data: new Float32Array(HISTORY * width), head: 0, count: 0 }});
+            const ringPush = (ring, rows, start) => {{
+                ring.data.set(rows.subarray(start, start + ring.width), ring.head * ring.width);
+                ring.head = (ring.head + 1) % HISTORY;
+                ring.count = Math.min(ring.count + 1, HISTORY);
+            }};
+            // Column `col` of the i-th oldest row
+            const ringAt = (ring, i, col) => ring.data[((ring.head - ring.count + i + HISTORY) % HISTORY) * ring.width + col];
+
+            const regionDataset = (region, i) => ({{
+                label: region.charAt(0).toUpperCase() + region.slice(1), data: new Array(HISTORY).fill(null),
+                borderColor: regionColors[i % regionColors.length], borderWidth: 2, pointRadius: 0, tension: 0.4
+            }});
+            let chartRegions = ['left', 'right'];
+            let regionRing = makeRing(chartRegions.length);
+            let channels = [], bands = [];
+            let bandRing = makeRing(0);
+            const metricData = {{ labels: new Array(HISTORY).fill(''), datasets: chartRegions.map(regionDataset) }};
+
+            const connectBtn = document.getElementById('connectBtn');
+            const statusLabel = document.getElementById('statusLabel');
+            const sensitivitySlider = document.getElementById('sensitivitySlider');
+            const sensitivityValue = document.getElementById('sensitivityValue');
+            const boardIdSelect = document.getElementById('boardIdSelect');
+            const macAddressInput = document.getElementById('macAddressInput');
+            const timeoutInput = document.getElementById('timeoutInput');
+            const recordToggle = document.getElementById('recordToggle');
+            const sessionInput = document.getElementById('sessionInput');
+            const userInput = document.getElementById('userInput');
+            const adaptiveToggle = document.getElementById('adaptiveToggle');
+            const executionModeSelect = document.getElementById('executionModeSelect');
+            const logArea = document.getElementById('logArea');
+            const viewSelect = document.getElementById('viewSelect');
+            const regionView = document.getElementById('regionView');
+            const channelCanvas = document.getElementById('channelCanvas');
+            const calibrateBtn = document.getElementById('calibrateBtn');
+            const calibrationStatus = document.getElementById('calibrationStatus');
+            const metricModeSelect = document.getElementById('metricModeSelect');
+            const smoothingSlider = document.getElementById('smoothingSlider');
+            const smoothingValue = document.getElementById('smoothingValue');
+            const qualityIndicator = document.getElementById('qualityIndicator');
+            const schedulerStats = document.getElementById('schedulerStats');
+            const bufferStats = document.getElementById('bufferStats');
+            const decisionStats = document.getElementById('decisionStats');
+            const dwellSlider = document.getElementById('dwellSlider');
+            const dwellValue = document.getElementById('dwellValue');
+            const keyActionSelect = document.getElementById('keyActionSelect');
+            const keyBindingsContainer = document.getElementById('keyBindingsContainer');
+            const profilingToggle = document.getElementById('profilingToggle');
+            const profileLink = document.getElementById('profileLink');
+            const stageStats = document.getElementById('stageStats');
+
+            const createChart = () => {{
+                const ctx = document.getElementById('metricChart').getContext('2d');
+                metricChart = new Chart(ctx, {{
+                    type: 'line',
+                    data: metricData,
+                    options: {{
+                        animation: false,
+                        scales: {{ y: {{ beginAtZero: true, grid: {{ color: 'rgba(255, 255, 255, 0.1)' }}, ticks: {{ color: '#9ca3af' }} }}, x: {{ display: false }} }},
+                        plugins: {{ legend: {{ display: true, labels: {{ color: '#9ca3af' }} }} }}
+                    }}
+                }});
+            }};
+
+            const renderChart = () => {{
+                const offset = HISTORY - regionRing.count;
+                metricChart.data.datasets.forEach((d, r) => {{
+                    for (let i = 0; i < HISTORY; i++) d.data[i] = i < offset ? null : ringAt(regionRing, i - offset, r);
+                }});
+                metricChart.update('none');
+            }};
+
+            // One strip per channel, log power scaled to that channel's range in view
+            const CHANNEL_STRIP_PX = 28;
+            const channelCtx = channelCanvas.getContext('2d');
+            const traceValues = new Float32Array(HISTORY);
+            const renderChannels = () => {{
+                const dpr = window.devicePixelRatio || 1;
+                const width = Math.round(channelCanvas.clientWidth * dpr), strip = CHANNEL_STRIP_PX * dpr;
+                const height = Math.max(1, channels.length) * strip;
+                if (channelCanvas.width !== width || channelCanvas.height !== height) {{
+                    channelCanvas.width = width; channelCanvas.height = height;
+                    channelCanvas.style.height = `${{height / dpr}}px`;
+                }}
+                channelCtx.clearRect(0, 0, width, height);
+                channelCtx.font = `${{11 * dpr}}px sans-serif`;
+                channelCtx.textBaseline = 'middle';
+                channelCtx.lineWidth = dpr;
+                const numBands = bands.length, band = bands.indexOf(viewSelect.value);
+                const labelWidth = 48 * dpr, step = (width - labelWidth) / (HISTORY - 1), count = bandRing.count;
+                channels.forEach((name, ch) => {{
+                    let lo = Infinity, hi = -Infinity;
+                    for (let i = 0; i < count; i++) {{
+                        let v = 0;
+                        if (band >= 0) v = ringAt(bandRing, i, ch * numBands + band);
+                        else for (let b = 0; b < numBands; b++) v += ringAt(bandRing, i, ch * numBands + b);
+                        v = Math.log10(v + 1e-12);
+                        traceValues[i] = v;
+                        if (v < lo) lo = v;
+                        if (v > hi) hi = v;
+                    }}
+                    const top = ch * strip, span = hi - lo || 1;
+                    channelCtx.fillStyle = '#9ca3af';
+                    channelCtx.fillText(name, 4 * dpr, top + strip / 2);
+                    channelCtx.strokeStyle = regionColors[ch % regionColors.length];
+                    channelCtx.beginPath();
+                    for (let i = 0; i < count; i++) {{
+                        const x = labelWidth + (HISTORY - count + i) * step;
+                        const y = top + strip - 2 * dpr - (traceValues[i] - lo) / span * (strip - 4 * dpr);
+                        if (i === 0) channelCtx.moveTo(x, y); else channelCtx.lineTo(x, y);
+                    }}
+                    channelCtx.stroke();
+                }});
+            }};
+
+            // The log keeps the newest LOG_LIMIT entries and only creates DOM rows
+            // for the lines scrolled into view.
+            const LOG_LIMIT = 1000, LOG_ROW_PX = 20;
+            const logEntries = [];
+            const logSpacer = document.createElement('div');
+            const logRows = document.createElement('div');
+            logSpacer.style.position = 'relative';
+            logRows.style.position = 'absolute';
+            logRows.style.left = logRows.style.right = '0';
+            logSpacer.appendChild(logRows);
+            logArea.appendChild(logSpacer);
+            let logDirty = false, logFollow = true;
+
+            const renderLog = () => {{
+                logDirty = false;
+                logSpacer.style.height = `${{logEntries.length * LOG_ROW_PX}}px`;
+                if (logFollow) logArea.scrollTop = logArea.scrollHeight;
+                const first = Math.floor(logArea.scrollTop / LOG_ROW_PX);
+                const visible = logEntries.slice(first, first + Math.ceil(logArea.clientHeight / LOG_ROW_PX) + 2);
+                logRows.style.top = `${{first * LOG_ROW_PX}}px`;
+                logRows.replaceChildren(...visible.map(([time, message]) => {{
+                    const row = document.createElement('div');
+                    const timeSpan = document.createElement('span');
+                    const messageSpan = document.createElement('span');
+                    row.className = 'log-row';
+                    row.title = message;
+                    timeSpan.className = 'text-gray-500';
+                    timeSpan.textContent = `${{time}}: `;
+                    messageSpan.className = 'text-gray-300';
+                    messageSpan.textContent = message;
+                    row.append(timeSpan, messageSpan);
+                    return row;
+                }}));
+            }};
+
+            let renderPending = false;
+            const render = () => {{
+                renderPending = false;
+                if (viewSelect.value === 'regions') {{ if (metricChart) renderChart(); }}
+                else renderChannels();
+                if (logDirty) renderLog();
+            }};
+            const scheduleRender = () => {{
+                if (renderPending) return;
+                renderPending = true;
+                requestAnimationFrame(render);
+            }};
+
+            const log = (message) => {{
+                logEntries.push([new Date().toLocaleTimeString(), String(message)]);
+                if (logEntries.length > LOG_LIMIT) logEntries.shift();
+                logDirty = true;
+                scheduleRender();
+            }};
+            logArea.addEventListener('scroll', () => {{
+                logFollow = logArea.scrollTop + logArea.clientHeight >= logArea.scrollHeight - LOG_ROW_PX;
+                logDirty = true;
+                scheduleRender();
+            }});
+            
+            socket.on('connect', () => {{
+                log('Successfully connected to Python server.');
+                socket.emit('join_session', {{ session: sessionInput.value }});
+                socket.emit('telemetry_config', {{ fps: 30, band_powers: viewSelect.value !== 'regions' }});
+            }});
+            socket.on('log_message', (msg) => log(msg));
+
+            const statusLabels = {{
+                disconnected: 'Disconnected', connecting: 'Connecting...', warming_up: 'Filling Buffer...',
+                streaming: 'Streaming', reconnecting: 'Reconnecting...', stopping: 'Stopping...'
+            }};
+            socket.on('connection_status', (data) => {{
+                const isStreaming = data.status === 'streaming';
+                const isActive = data.status !== 'disconnected';
+                statusLabel.textContent = `Status: ${{statusLabels[data.status] || data.status}}`;
+                statusLabel.className = `text-center font-semibold text-lg ${{isStreaming ? 'text-green-400' : isActive ? 'text-yellow-400' : 'text-red-400'}}`;
+                connectBtn.textContent = isActive ? 'Disconnect' : 'Connect';
+                connectBtn.disabled = data.status === 'stopping';
+                connectBtn.classList.toggle('bg-indigo-600', !isActive);
+                connectBtn.classList.toggle('bg-red-600', isActive);
+                calibrateBtn.disabled = !isStreaming;
+                calibrateBtn.textContent = isStreaming ? 'Calibrate' : 'Calibrate (Connect First)';
+                if (!isActive) calibrationStatus.textContent = '';
+            }});
+
+            socket.on('calibration_status', (data) => {{
+                if (data.status === 'calibrating') {{
+                    calibrationStatus.textContent = `Calibrating... Please relax. ${{data.countdown}}s remaining.`;
+                    calibrateBtn.disabled = true;
+                }} else if (data.status === 'complete') {{
+                    const baselines = Object.entries(data.baselines).map(([region, b]) =>
+                        `${{region}}: ${{b.center.toFixed(2)}} ± ${{b.scale.toFixed(2)}}`).join(', ');
+                    const heading = data.source === 'profile' ? 'Loaded saved calibration.' : 'Calibration Complete!';
+                    calibrationStatus.textContent = `${{heading}} Baselines: ${{baselines}}`;
+                    calibrateBtn.disabled = false;
+                }} else if (data.status === 'failed') {{
+                    calibrationStatus.textContent = 'Calibration failed. Please try again.';
+                    calibrateBtn.disabled = false;
+                }}
+            }});
+            
+            let qualityTimeout;
+            const showPoorSignal = () => {{
+                qualityIndicator.style.opacity = 1;
+                clearTimeout(qualityTimeout);
+                qualityTimeout = setTimeout(() => {{
+                    qualityIndicator.style.opacity = 0;
+                }}, 1500);
+            }};
+
+            // Frames hold float32 rows: [t - t0, one value per region, ...optional band powers]
+            socket.on('metric_frame', (frame) => {{
+                if (frame.quality === 'bad') showPoorSignal();
+                if (frame.regions.join() !== chartRegions.join()) {{
+                    chartRegions = frame.regions;
+                    chartRegions.forEach(addKeyBinding);
+                    regionRing = makeRing(chartRegions.length);
+                    if (metricChart) metricChart.data.datasets = chartRegions.map(regionDataset);
+                }}
+                if (frame.band_powers && (frame.channels.join() !== channels.join() || frame.bands.join() !== bands.join())) {{
+                    channels = frame.channels;
+                    bands = frame.bands;
+                    bandRing = makeRing(channels.length * bands.length);
+                }}
+                const rows = new Float32Array(frame.data);
+                const bandStart = 1 + chartRegions.length;
+                for (let i = 0; i < rows.length; i += frame.stride) {{
+                    ringPush(regionRing, rows, i + 1);
+                    if (frame.band_powers) ringPush(bandRing, rows, i + bandStart);
+                }}
+                scheduleRender();
+            }});
+
+            viewSelect.addEventListener('change', () => {{
+                const channelView = viewSelect.value !== 'regions';
+                regionView.classList.toggle('hidden', channelView);
+                channelCanvas.classList.toggle('hidden', !channelView);
+                // Band powers are only sent while a channel view is open
+                if (channelView) bandRing.count = 0;
+                socket.emit('telemetry_config', {{ band_powers: channelView }});
+                scheduleRender();
+            }});
+            
+            socket.on('scheduler_stats', (stats) => {{
+                schedulerStats.textContent = `Tick p50 ${{stats.tick_ms.p50.toFixed(1)}} ms, p99 ${{stats.tick_ms.p99.toFixed(1)}} ms | ` +
+                    `jitter p99 ${{stats.jitter_ms.p99.toFixed(1)}} ms | missed ${{stats.missed_deadlines}}`;
+            }});
+
+            socket.on('buffer_stats', (stats) => {{
+                const memoryKb = stats.board_buffer_kb + stats.pipeline_kb;
+                bufferStats.textContent = `Buffer ${{stats.pending_samples}}/${{stats.capacity_samples}} samples ` +
+                    `(peak ${{(stats.occupancy * 100).toFixed(1)}}%) | memory ${{memoryKb.toFixed(0)}} KiB` +
+                    (stats.overflows ? ` | overflows ${{stats.overflows}}` : '') +
+                    (stats.recorder_dropped ? ` | recorder dropped ${{stats.recorder_dropped}}` : '');
+            }});
+
+            socket.on('decision_stats', (stats) => {{
+                const fmt = (s) => s ? `mean ${{s.mean_ms.toFixed(1)}} ms, p99 <${{s.p99_ms.toFixed(1)}} ms` : '-';
+                decisionStats.textContent = `Sample to decision ${{fmt(stats.sample_to_decision)}} | to key ${{fmt(stats.sample_to_key)}}`;
+            }});
+
+            socket.on('stage_stats', (stats) => {{
+                if (!profilingToggle.checked) return;
+                stageStats.textContent = Object.entries(stats).map(([stage, s]) =>
+                    `${{stage.padEnd(16)}} mean ${{s.mean_ms.toFixed(2)}} ms  p99 <${{s.p99_ms.toFixed(2)}} ms  max ${{s.max_ms.toFixed(2)}} ms`
+                ).join('\\n');
+            }});
+
+            // Profile the data thread of the session this tab is in
+            profileLink.addEventListener('click', () => {{
+                profileLink.href = `/profile?seconds=5&session=${{encodeURIComponent(sessionInput.value.trim() || 'default')}}`;
+            }});
+
+            profilingToggle.addEventListener('change', () => {{
+                socket.emit('set_profiling', {{ enabled: profilingToggle.checked }});
+                if (!profilingToggle.checked) stageStats.textContent = '';
+            }});
+
+            connectBtn.addEventListener('click', () => {{
+                if (connectBtn.textContent === 'Disconnect') {{
+                    socket.emit('stop_stream');
+                }} else {{
+                    socket.emit('start_stream', {{ 
+                        board_id: boardIdSelect.value,
+                        mac_address: macAddressInput.value,
+                        timeout: timeoutInput.value,
+                        record: recordToggle.checked,
+                        user: userInput.value,
+                        execution_mode: executionModeSelect.value
+                    }});
+                }}
+            }});
+
+            sessionInput.addEventListener('change', () => {{
+                regionRing.count = 0;
+                bandRing.count = 0;
+                scheduleRender();
+                socket.emit('join_session', {{ session: sessionInput.value }});
+            }});
+
+            calibrateBtn.addEventListener('click', () => {{
+                socket.emit('start_calibration');
+            }});
+            
+            const sendSettings = () => {{
+                const keyBindings = {{}};
+                document.querySelectorAll('.key-binding-input').forEach(input => {{
+                    keyBindings[input.dataset.state] = input.value;
+                }});
+
+                socket.emit('update_settings', {{
+                    sensitivity: sensitivitySlider.value,
+                    key_bindings: keyBindings,
+                    metric_mode: metricModeSelect.value,
+                    smoothing: smoothingSlider.value,
+                    decision: {{ dwell_s: dwellSlider.value / 1000, action: keyActionSelect.value }},
+                    adaptive_baseline: adaptiveToggle.checked,
+                }});
+            }};
+
+            // Montages with more regions than left/right get a binding row per region
+            const addKeyBinding = (region) => {{
+                if (document.getElementById(`key-${{region}}`)) return;
+                const row = document.createElement('div');
+                row.className = 'flex items-center space-x-2';
+                row.innerHTML = `<label for="key-${{region}}" class="w-1/3 text-sm font-medium"></label>` +
+                    `<input type="text" id="key-${{region}}" class="key-binding-input bg-gray-700 border border-gray-600 text-gray-200 text-sm rounded-lg block w-2/3 p-2.5">`;
+                row.querySelector('label').textContent = `${{region.charAt(0).toUpperCase() + region.slice(1)}}:`;
+                const input = row.querySelector('input');
+                input.dataset.state = region;
+                input.addEventListener('change', sendSettings);
+                keyBindingsContainer.appendChild(row);
+            }};
+            
+            sensitivitySlider.addEventListener('input', (e) => {{
+                sensitivityValue.textContent = parseFloat(e.target.value).toFixed(1);
+            }});
+            smoothingSlider.addEventListener('input', (e) => {{
+                smoothingValue.textContent = parseFloat(e.target.value).toFixed(2);
+            }});
+            dwellSlider.addEventListener('input', (e) => {{
+                dwellValue.textContent = e.target.value;
+            }});
+
+            sensitivitySlider.addEventListener('change', sendSettings);
+            smoothingSlider.addEventListener('change', sendSettings);
+            dwellSlider.addEventListener('change', sendSettings);
+            keyActionSelect.addEventListener('change', sendSettings);
+            adaptiveToggle.addEventListener('change', sendSettings);
+            
+            document.querySelectorAll('.key-binding-input').forEach(input => {{
+                input.addEventListener('change', sendSettings);
+            }});
+
+            metricModeSelect.addEventListener('change', sendSettings);
+            socket.on('metric_defined', (metric) => {{
+                let option = [...metricModeSelect.options].find(o => o.value === metric.name);
+                if (!option) {{
+                    option = document.createElement('option');
+                    option.value = metric.name;
+                    metricModeSelect.appendChild(option);
+                }}
+                option.textContent = metric.label;
+            }});
+
+            createChart();
+        }});
+    </script>
+</body>
+</html>
+"""
+
+# --- Profiling ---
+def sample_stacks(thread_ids, seconds, interval):
+    # Poor man's sampling profiler: periodically snapshot the Python stacks of
+    # the given threads and count them in collapsed ("folded") format, which
+    # flamegraph.pl and speedscope read directly.
+    counts = collections.Counter()
+    own_id = threading.get_ident()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frames = sys._current_frames()
+        for thread_id in (thread_ids or frames.keys()):
+            frame = frames.get(thread_id)
+            if frame is None or thread_id == own_id: continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return '\n'.join(f"{stack} {count}" for stack, count in counts.most_common()) + '\n'
+
+# --- Feature Publishing ---
+# The data thread computes each tick's features exactly once and hands them
+# to every subscriber (calibration, and anything else that needs them).
+class FeatureBus:
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, features):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(features)
+            except Exception as e:
+                print(f"Error in feature subscriber: {e}")
+
+# --- Key Output ---
+KEY_MAP = {
+    'space': Key.space, 'enter': Key.enter, 'esc': Key.esc, 'up': Key.up, 'down': Key.down, 'left': Key.left, 'right': Key.right,
+    'shift': Key.shift, 'ctrl': Key.ctrl, 'alt': Key.alt, 'win': Key.cmd, 'cmd': Key.cmd,
+    'tab': Key.tab, 'caps_lock': Key.caps_lock, 'delete': Key.delete,
+    'f1': Key.f1, 'f2': Key.f2, 'f3': Key.f3, 'f4': Key.f4, 'f5': Key.f5, 'f6': Key.f6, 'f7': Key.f7, 'f8': Key.f8, 'f9': Key.f9, 'f10': Key.f10, 'f11': Key.f11, 'f12': Key.f12,
+    'page_up': Key.page_up, 'pgup': Key.page_up, 'page_down': Key.page_down, 'pgdn': Key.page_down,
+    'home': Key.home, 'end': Key.end, 'insert': Key.insert
+}
+
+def compile_key_binding(key_str):
+    # 'ctrl+alt+delete' -> (Key.ctrl, Key.alt, Key.delete); the last key is the primary key
+    keys = [k.strip() for k in key_str.lower().strip().split('+')]
+    parsed_keys = tuple(KEY_MAP.get(k, k) for k in keys if len(k) == 1 or k in KEY_MAP)
+    if not parsed_keys: raise ValueError("No valid keys found.")
+    return parsed_keys
+
+# Presses keys on its own thread so a slow OS input stack never delays the
+# data thread. Detection only enqueues; a full queue drops the action.
+# Actions are 'tap' (press and release), 'press' (hold until a matching
+# 'release') or 'release'. When given the perf_counter time the triggering
+# samples arrived, the worker records sample-to-key latency in `latency`.
+class KeyOutputWorker:
+    def __init__(self, keyboard, emit, latency=None, max_pending=8):
+        self.keyboard = keyboard
+        self.emit = emit
+        self.latency = latency
+        self.actions = queue.Queue(maxsize=max_pending)
+        self.held = {}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, focus_state, key_str, keys, action='tap', arrived=None):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        try:
+            # Releases must not be lost, or the key stays down
+            if action == 'release': self.actions.put((focus_state, key_str, keys, action, arrived))
+            else: self.actions.put_nowait((focus_state, key_str, keys, action, arrived))
+            return True
+        except queue.Full:
+            print(f"Key output queue full, dropping '{key_str}'.")
+            return False
+
+    def _run(self):
+        while True:
+            focus_state, key_str, keys, action, arrived = self.actions.get()
+            try:
+                if action == 'release':
+                    held = self.held.pop(focus_state, None)
+                    if held is None: continue
+                    key_str, keys = held
+                    *modifiers, primary_key = keys
+                    self.keyboard.release(primary_key)
+                    for mod in reversed(modifiers): self.keyboard.release(mod)
+                    message = f"State Ended: '{focus_state.upper()}'. Releasing '{key_str}'."
+                else:
+                    *modifiers, primary_key = keys
+                    for mod in modifiers: self.keyboard.press(mod)
+                    self.keyboard.press(primary_key)
+                    if action == 'press':
+                        self.held[focus_state] = (key_str, keys)
+                        message = f"State Detected: '{focus_state.upper()}'. Holding '{key_str}'."
+                    else:
+                        self.keyboard.release(primary_key)
+                        for mod in reversed(modifiers): self.keyboard.release(mod)
+                        message = f"State Detected: '{focus_state.upper()}'. Pressing '{key_str}'."
+                if arrived is not None and self.latency is not None:
+                    self.latency.record('sample_to_key', arrived)
+                print(message)
+                self.emit('log_message', message)
+            except Exception as e:
+                print(f"Error pressing key '{key_str}': {repr(e)}")
+                self.emit('log_message', f"Error pressing key '{key_str}': {repr(e)}")
+
+# --- Telemetry ---
+# Coalesces per-tick features into periodic binary frames. Each client picks
+# its own frame rate and whether per-channel band powers are included; a
+# frame carries every tick since that client's previous frame as float32
+# rows of [t - t0, ema per region, (band power per channel and band)].
+# Frames with band powers also name the channels and bands.
+class TelemetryPublisher:
+    def __init__(self, max_rows=600):
+        self.regions = ('left', 'right')
+        self.channels = ()
+        self.bands = tuple(BANDS)
+        self.rows = collections.deque(maxlen=max_rows)
+        self.seq = 0
+        self.t0 = None
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.task = None
+
+    def reset(self):
+        with self.lock:
+            self.rows.clear()
+            self.t0 = None
+
+    def on_features(self, features):
+        band_powers = features.get('band_powers')
+        with self.lock:
+            if self.t0 is None:
+                self.t0 = features['timestamp']
+                self.regions = tuple(features['emas'])
+            self.seq += 1
+            head = [features['timestamp'] - self.t0] + [features['emas'].get(r, 0.0) for r in self.regions]
+            self.rows.append((self.seq, np.array(head, dtype=np.float32),
+                              None if band_powers is None else band_powers.astype(np.float32).ravel(),
+                              features.get('signal_quality') == 'bad'))
+
+    def add_client(self, sid, fps=10, band_powers=False):
+        with self.lock:
+            self.clients[sid] = {'interval': 1.0 / fps, 'band_powers': band_powers, 'last_seq': self.seq, 'next_due': 0.0}
+            if self.task is None:
+                self.task = socketio.start_background_task(self._run)
+
+    def configure(self, sid, fps=None, band_powers=None):
+        with self.lock:
+            client = self.clients.get(sid)
+            if client is None: return
+            if fps is not None: client['interval'] = 1.0 / min(max(float(fps), 1.0), 60.0)
+            if band_powers is not None: client['band_powers'] = bool(band_powers)
+
+    def remove_client(self, sid):
+        with self.lock:
+            return self.clients.pop(sid, None)
+
+    def _build_frame(self, client):
+        rows = [row for row in self.rows if row[0] > client['last_seq']]
+        if not rows: return None
+        client['last_seq'] = rows[-1][0]
+        with_bands = client['band_powers'] and all(row[2] is not None for row in rows)
+        data = np.stack([np.concatenate([row[1], row[2]]) if with_bands else row[1] for row in rows])
+        frame = {
+            't0': self.t0,
+            'regions': list(self.regions),
+            'stride': data.shape[1],
+            'band_powers': with_bands,
+            'quality': 'bad' if any(row[3] for row in rows) else 'good',
+            'data': data.tobytes(),
+        }
+        if with_bands:
+            frame['channels'] = list(self.channels)
+            frame['bands'] = list(self.bands)
+        return frame
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            frames = []
+            with self.lock:
+                if not self.clients:
+                    self.task = None
+                    return
+                next_due = now + 0.1
+                for sid, client in self.clients.items():
+                    if now >= client['next_due']:
+                        client['next_due'] = now + client['interval']
+                        frame = self._build_frame(client)
+                        if frame: frames.append((sid, frame))
+                    next_due = min(next_due, client['next_due'])
+            for sid, frame in frames:
+                socketio.emit('metric_frame', frame, to=sid)
+            socketio.sleep(max(next_due - time.monotonic(), 0.005))
+
+# --- Global state management ---
+# One BCIState per session. A session is a Socket.IO room: every browser tab
+# that joins it controls and watches the same board, and sessions never
+# share boards, baselines, settings or telemetry.
+class BCIState:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.board = None
+        self.is_streaming = False
+        self.is_calibrating = False
+        self.eeg_channels = []
+        self.decision = dict(DEFAULT_DECISION)
+        self.state_settings = {}
+        self.decision_engine = None
+        self.decision_latency = StageTimers()
+        self.decision_latency.enabled = True
+        self.params = BrainFlowInputParams()
+        self.keyboard = Controller()
+        self.board_id = 41
+        self.sensitivity = 2.0 
+        self.key_bindings = {}
+        self.compiled_bindings = {}
+        self.key_worker = KeyOutputWorker(self.keyboard, self.emit, self.decision_latency)
+        self.user = 'default'
+        self.profile = {}
+        self.profile_key = None
+        self.baselines = {}
+        self.baseline_stats = RunningStats(())
+        self.adaptive_baseline = False
+        self.montage_layout = 'hemispheres'
+        self.montage = None
+        self.metric_mode = 'alpha'
+        self.smoothing_factor = 0.2
+        self.metric_emas = {}
+        self.feature_bus = FeatureBus()
+        self.scheduler_policy = 'skip'
+        self.execution_mode = 'thread'
+        self.connection_state = 'disconnected'
+        self.stop_event = threading.Event()
+        self.lifecycle_thread = None
+        self.lifecycle_lock = threading.Lock()
+        self.record_requested = False
+        self.stall_timeout_s = 5.0
+        self.window_seconds = 2
+        self.filters = dict(DEFAULT_FILTERS)
+        self.active_filters = self.filters  # what the current connection actually uses
+        self.stream_buffer_samples = 0
+        self.buffer_stats = None
+        self.reconnect_backoff_s = 1.0
+        self.max_reconnect_backoff_s = 30.0
+        self.scheduler = None
+        self.stage_timers = StageTimers()
+        self.data_thread_id = None
+        self.recorder = None
+        self.telemetry = TelemetryPublisher()
+        self.feature_bus.subscribe(self.telemetry.on_features)
+
+    def emit(self, event, data):
+        socketio.emit(event, data, to=self.session_id)
+
+DEFAULT_SESSION = 'default'
+sessions = {}
+client_sessions = {}
+sessions_lock = threading.Lock()
+
+def get_session(session_id):
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = BCIState(session_id)
+        return session
+
+def current_session():
+    return get_session(client_sessions.get(request.sid, DEFAULT_SESSION))
+
+
+# --- Tick Scheduling ---
+# Fixed monotonic deadlines for the processing loop. When a tick overruns,
+# 'skip' drops the missed deadlines and realigns to the grid, while
+# 'catch_up' runs the missed ticks back to back (bounded by max_backlog).
+class TickScheduler:
+    POLICIES = ('skip', 'catch_up')
+
+    def __init__(self, rate_hz, policy='skip', max_backlog=5, history=600):
+        self.period = 1.0 / rate_hz
+        self.policy = policy if policy in self.POLICIES else 'skip'
+        self.max_backlog = max_backlog
+        self.next_deadline = None
+        self.tick_start = None
+        self.durations = collections.deque(maxlen=history)
+        self.lateness = collections.deque(maxlen=history)
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.skipped_ticks = 0
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        delay = self.next_deadline - now
+        if delay > 0:
+            time.sleep(delay)
+            now = time.monotonic()
+        self.lateness.append(now - self.next_deadline)
+        self.tick_start = now
+
+    def tick_done(self):
+        end = time.monotonic()
+        self.durations.append(end - self.tick_start)
+        self.ticks += 1
+        self.next_deadline += self.period
+        if end > self.next_deadline:
+            missed = int((end - self.next_deadline) // self.period) + 1
+            self.missed_deadlines += missed
+            if self.policy == 'skip' or missed > self.max_backlog:
+                self.skipped_ticks += missed
+                self.next_deadline += missed * self.period
+
+    def stats(self):
+        durations = np.array(self.durations) * 1000.0
+        lateness = np.array(self.lateness) * 1000.0
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99]) if len(durations) else (0.0, 0.0, 0.0)
+        return {
+            'policy': self.policy,
+            'period_ms': self.period * 1000.0,
+            'ticks': self.ticks,
+            'missed_deadlines': self.missed_deadlines,
+            'skipped_ticks': self.skipped_ticks,
+            'tick_ms': {'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+                        'max': float(durations.max()) if len(durations) else 0.0},
+            'jitter_ms': {'mean': float(lateness.mean()) if len(lateness) else 0.0,
+                          'p99': float(np.percentile(lateness, 99)) if len(lateness) else 0.0},
+        }
+
+# --- Stream Buffer Sizing ---
+# The data thread drains BrainFlow's buffer on every tick, so it only has to
+# hold one analysis window plus enough slack to ride out a stalled tick or a
+# reconnect. Recording gets more slack because samples lost there are gone
+# from the file too.
+STREAM_HEADROOM_SECONDS = 10
+RECORDING_HEADROOM_SECONDS = 60
+MIN_STREAM_BUFFER_SAMPLES = 1024
+
+def stream_buffer_size(board_id, window_seconds, recording=False):
+    sampling_rate = board_info(board_id)['sampling_rate']
+    headroom = RECORDING_HEADROOM_SECONDS if recording else STREAM_HEADROOM_SECONDS
+    return max(MIN_STREAM_BUFFER_SAMPLES, int(np.ceil(sampling_rate * (window_seconds + headroom))))
+
+class BufferOccupancy:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.pending = 0
+        self.peak = 0
+        self.overflows = 0
+        self.drained = 0
+
+    def observe(self, pending):
+        self.pending = pending
+        self.peak = max(self.peak, pending)
+        self.drained += pending
+        # BrainFlow silently drops the oldest samples once its ring is full
+        if self.capacity and pending >= self.capacity:
+            self.overflows += 1
+
+    def stats(self, board_buffer_bytes, pipeline_bytes, recorder=None):
+        return {
+            'capacity_samples': self.capacity,
+            'pending_samples': self.pending,
+            'peak_samples': self.peak,
+            'occupancy': self.peak / self.capacity if self.capacity else 0.0,
+            'overflows': self.overflows,
+            'drained_samples': self.drained,
+            'board_buffer_kb': board_buffer_bytes / 1024.0,
+            'pipeline_kb': pipeline_bytes / 1024.0,
+            'recorder_pending': recorder.pending.qsize() if recorder else 0,
+            'recorder_dropped': recorder.dropped if recorder else 0,
+        }
+
+# --- Backend Data Processing Thread ---
+def data_processing_thread(session):
+    descr = board_info(session.board_id)
+    sampling_rate = descr['sampling_rate']
+    window_seconds = session.window_seconds
+    refresh_rate_hz = 5
+    
+    print(f"Using montage: {session.montage.channel_map}")
+    timestamp_channel = descr['timestamp_channel']
+    timers = session.stage_timers
+    pipeline_class = EXECUTION_MODES.get(session.execution_mode, ProcessingPipeline)
+    pipeline = pipeline_class(session.eeg_channels, sampling_rate, session.montage, window_seconds, timers,
+                              session.active_filters)
+    session.metric_emas = pipeline.metric_emas
+    last_timestamp = 0.0
+    scheduler = TickScheduler(refresh_rate_hz, session.scheduler_policy)
+    session.scheduler = scheduler
+    session.data_thread_id = threading.get_ident()
+    last_data_time = time.monotonic()
+    exit_reason = 'stopped'
+    occupancy = BufferOccupancy(session.stream_buffer_samples)
+    board_buffer_bytes = session.stream_buffer_samples * descr['num_rows'] * 8
+    
+    while session.is_streaming:
+        scheduler.wait()
+        try:
+            if scheduler.ticks % refresh_rate_hz == 0:
+                session.emit('scheduler_stats', scheduler.stats())
+                session.buffer_stats = occupancy.stats(board_buffer_bytes, pipeline.nbytes, session.recorder)
+                session.emit('buffer_stats', session.buffer_stats)
+                session.emit('decision_stats', session.decision_latency.stats())
+                if (session.adaptive_baseline and not session.is_calibrating and
+                        session.baseline_stats.ready(MIN_BASELINE_SAMPLES)):
+                    store_baselines(session, session.baseline_stats.baselines())
+                if timers.enabled:
+                    session.emit('stage_stats', timers.stats())
+
+            # Drain everything that arrived since the last tick, so a late tick
+            # neither skips nor re-processes samples.
+            t = timers.mark()
+            new_count = int(session.board.get_board_data_count())
+            occupancy.observe(new_count)
+            if new_count == 0:
+                # Nothing new (e.g. catch-up ticks after an overrun): the
+                # features, EMAs and decisions would only repeat the last tick.
+                if time.monotonic() - last_data_time > session.stall_timeout_s:
+                    exit_reason = 'stalled'
+                    break
+                continue
+            arrived = time.perf_counter()
+            data = session.board.get_board_data(new_count)
+            timers.record('read', t)
+            pipeline.push(data[session.eeg_channels])
+            last_timestamp = data[timestamp_channel, -1]
+            last_data_time = time.monotonic()
+            if session.recorder:
+                session.recorder.record_eeg(data[session.eeg_channels], data[timestamp_channel])
+            if not pipeline.ready:
+                continue
+            if session.connection_state == 'warming_up':
+                # Ready as soon as a full analysis window has actually arrived
+                set_connection_state(session, 'streaming')
+                session.emit('log_message', 'Buffer filled. Ready for calibration.')
+
+            features = pipeline.compute(session.metric_mode, session.smoothing_factor, last_timestamp)
+            if features is None:
+                continue
+            t = timers.mark()
+            session.feature_bus.publish(features)
+            t = timers.record('publish', t)
+
+            if not session.is_calibrating:
+                 emas = ', '.join(f"{region}={value:.2f}" for region, value in features['emas'].items())
+                 print(f"[{session.session_id}] Smoothed Metrics ({session.metric_mode}): {emas}")
+            t = timers.record('print', t)
+
+            if session.is_calibrating:
+                release_actions(session)
+            elif not features['artifact']:
+                run_decisions(session, features, arrived)
+            # While adapting, samples taken during an active state are left out
+            # so a long activation does not become the new baseline.
+            if not features['artifact'] and (session.is_calibrating or
+                                             (session.adaptive_baseline and not session.decision_engine.active.any())):
+                # Only regions that still had valid channels this tick
+                session.baseline_stats.push({region: features['emas'][region] for region in features['regions']})
+            t = timers.record('triggers', t)
+        except Exception as e:
+            print(f"Error in data thread: {e}")
+            exit_reason = 'error'
+            break
+        finally:
+            scheduler.tick_done()
+    release_actions(session)
+    pipeline.close()
+    print("Data thread stopped.")
+    return exit_reason
+
+# --- Board Connection Management ---
+# One lifecycle thread per session owns the BoardShim: it connects, runs the
+# data loop, releases the board, and reconnects with exponential backoff if
+# the board stops delivering data. Socket.IO handlers only request changes,
+# so they never block on prepare_session() and never release a board the
+# data loop is still reading.
+CONNECTION_STATES = ('disconnected', 'connecting', 'warming_up', 'streaming', 'reconnecting', 'stopping')
+
+def set_connection_state(session, state):
+    session.connection_state = state
+    session.emit('connection_status', {'status': state})
+
+def connect_board(session):
+    set_connection_state(session, 'connecting')
+    print(f"Attempting to connect to board ID: {session.board_id} with mac: '{session.params.mac_address}', timeout: {session.params.timeout}")
+    session.emit('log_message', f"Initializing board ID: {session.board_id}...")
+    BoardShim.enable_dev_board_logger()
+    board = BoardShim(session.board_id, session.params)
+    board.prepare_session()
+    session.stream_buffer_samples = stream_buffer_size(session.board_id, session.window_seconds, session.record_requested)
+    try:
+        board.start_stream(session.stream_buffer_samples)
+    except Exception:
+        board.release_session()
+        raise
+    session.board = board
+    descr = board_info(session.board_id)
+    session.eeg_channels = descr['eeg_channels']
+    try:
+        session.montage = build_montage(session.eeg_channels, descr['eeg_names'], session.montage_layout)
+    except ValueError as e:
+        session.emit('log_message', f"Montage error: {e}. Using hemispheres.")
+        session.montage = build_montage(session.eeg_channels, descr['eeg_names'])
+    session.active_filters = session.filters
+    if session.filters != DEFAULT_FILTERS:
+        # The defaults quietly skip notches above Nyquist; user settings must fit the board
+        try:
+            session.active_filters = parse_filter_settings(session.filters, {}, descr['sampling_rate'])
+        except ValueError as e:
+            session.emit('log_message', f"Filter error: {e}. Using defaults.")
+            session.active_filters = dict(DEFAULT_FILTERS)
+    session.telemetry.channels = tuple(descr['eeg_names'])
+    session.decision_engine = DecisionEngine(session.montage.regions)
+    # Reconnects keep the in-memory profile, which may have adapted since it was loaded
+    if session.profile_key != (session.user, session.board_id):
+        session.profile = load_profile(session.user, session.board_id)
+        session.profile_key = (session.user, session.board_id)
+    if apply_profile(session):
+        session.emit('log_message', f"Loaded calibration profile for '{session.user}'.")
+        session.emit('calibration_status', {'status': 'complete', 'baselines': session.baselines, 'source': 'profile'})
+    set_connection_state(session, 'warming_up')
+    session.emit('log_message', 'Connection successful. Filling buffer...')
+
+def release_board(session):
+    board, session.board = session.board, None
+    if board is None: return
+    try:
+        board.stop_stream()
+    except Exception as e:
+        print(f"Error stopping stream: {e}")
+    try:
+        board.release_session()
+    except Exception as e:
+        print(f"Error releasing session: {e}")
+
+def board_lifecycle_thread(session):
+    backoff = session.reconnect_backoff_s
+    connected_once = False
+    try:
+        while session.is_streaming:
+            try:
+                connect_board(session)
+            except Exception as e:
+                print(f"Connection Error: {e}")
+                session.emit('log_message', f"Error: {e}")
+                if not connected_once:
+                    break
+            else:
+                if not connected_once and session.record_requested:
+                    start_recording(session)
+                connected_once = True
+                backoff = session.reconnect_backoff_s
+                # Errors inside the loop come back as 'error'; anything raised
+                # here (e.g. the pipeline could not be built) ends the stream
+                exit_reason = data_processing_thread(session)
+                release_board(session)
+                if exit_reason == 'stopped' or not session.is_streaming:
+                    break
+                session.emit('log_message', f"Board {'stopped sending data' if exit_reason == 'stalled' else 'failed'}.")
+            set_connection_state(session, 'reconnecting')
+            session.emit('log_message', f"Reconnecting in {backoff:.0f} s...")
+            if session.stop_event.wait(backoff):
+                break
+            backoff = min(backoff * 2, session.max_reconnect_backoff_s)
+    except Exception as e:
+        print(f"Stream Error: {e}")
+        session.emit('log_message', f"Error: {e}")
+    finally:
+        release_board(session)
+        stop_recording(session)
+        if session.adaptive_baseline and session.baselines:
+            save_profile(session)
+        with session.lifecycle_lock:
+            session.is_streaming = False
+            session.lifecycle_thread = None
+            set_connection_state(session, 'disconnected')
+        print("Streaming stopped.")
+        session.emit('log_message', 'Stream stopped.')
+
+def start_recording(session):
+    descr = board_info(session.board_id)
+    try:
+        session.recorder = SessionRecorder(session.board_id, descr['sampling_rate'],
+                                           session.eeg_channels, descr['eeg_names'], BANDS, session.montage.regions,
+                                           montage=session.montage.spec, session_id=session.session_id)
+    except OSError as e:
+        session.emit('log_message', f"Could not start recording: {e}")
+        return
+    session.feature_bus.subscribe(session.recorder.on_features)
+    session.emit('log_message', f"Recording to {session.recorder.path}")
+
+def stop_recording(session):
+    recorder = session.recorder
+    if not recorder: return
+    session.recorder = None
+    session.feature_bus.unsubscribe(recorder.on_features)
+    path = recorder.close(metric_mode=session.metric_mode, smoothing_factor=session.smoothing_factor,
+                          sensitivity=session.sensitivity, baselines=session.baselines,
+                          decision=session.decision, state_settings=session.state_settings,
+                          filters=session.active_filters, window_seconds=session.window_seconds)
+    session.emit('log_message', f"Recording saved to {path}")
+
+# --- Decision Settings ---
+# Session glue around DecisionEngine: settings validation, configuration and
+# turning engine events into key actions.
+def parse_decision_settings(data, current, allow_sensitivity=False):
+    settings = dict(current)
+    numeric = ('hysteresis', 'dwell_s', 'refractory_s') + (('sensitivity',) if allow_sensitivity else ())
+    for key, value in data.items():
+        if key in numeric:
+            settings[key] = float(value)
+            if settings[key] < 0: raise ValueError(f"{key} must not be negative")
+        elif key == 'action':
+            if value not in DECISION_ACTIONS: raise ValueError(f"unknown action '{value}'")
+            settings[key] = value
+        else:
+            raise ValueError(f"unknown setting '{key}'")
+    if settings.get('hysteresis', 0.0) >= 1.0: raise ValueError("hysteresis must be below 1")
+    return settings
+
+def configure_decisions(session):
+    if session.decision_engine:
+        session.decision_engine.set_baselines(session.baselines)
+        session.decision_engine.configure(session.sensitivity, session.decision, session.state_settings)
+
+def run_decisions(session, features, arrived):
+    for state, action in session.decision_engine.update(features['emas'], features['timestamp']):
+        dispatch_action(session, state, action, arrived)
+    session.decision_latency.record('sample_to_decision', arrived)
+
+def release_actions(session):
+    # Lets go of held keys when triggering pauses or the stream ends
+    if session.decision_engine:
+        for state, action in session.decision_engine.release_all():
+            dispatch_action(session, state, action)
+
+def dispatch_action(session, state, action, arrived=None):
+    if action != 'release' and session.recorder:
+        session.recorder.record_trigger(state, time.time())
+    if action == 'release':
+        # The worker remembers which keys it is holding, so a binding cleared
+        # while the key is down cannot strand it
+        session.key_worker.submit(state, None, (), action=action, arrived=arrived)
+        return
+    binding = session.compiled_bindings.get(state)
+    if binding:
+        session.key_worker.submit(state, *binding, action=action, arrived=arrived)
+
+
+# --- Baseline Calibration ---
+# The data thread feeds clean EMAs into the session's RunningStats; the
+# resulting baselines are kept per metric in a profile per user and board.
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+MIN_BASELINE_SAMPLES = 10
+
+def profile_path(user, board_id):
+    name = re.sub(r'[^A-Za-z0-9_-]+', '_', user).strip('_') or 'default'
+    return os.path.join(PROFILES_DIR, f"{name}_board{board_id}.json")
+
+def load_profile(user, board_id):
+    try:
+        with open(profile_path(user, board_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Could not read profile for '{user}': {e}")
+        return {}
+
+def save_profile(session):
+    profile = session.profile
+    profile.update(user=session.user, board_id=session.board_id, updated=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    path = profile_path(session.user, session.board_id)
+    try:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(profile, f, indent=2)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"Could not save profile {path}: {e}")
+
+def apply_profile(session):
+    # Baselines are stored per metric; returns True when the profile covers
+    # every region of the current montage.
+    regions = session.montage.regions
+    session.baseline_stats = RunningStats(regions)
+    baselines = session.profile.get('baselines', {}).get(session.metric_mode, {})
+    if all(region in baselines for region in regions):
+        session.baselines = {region: baselines[region] for region in regions}
+        session.baseline_stats.seed(session.baselines)
+    else:
+        session.baselines = {}
+    configure_decisions(session)
+    return bool(session.baselines)
+
+def store_baselines(session, baselines):
+    session.baselines = baselines
+    session.profile.setdefault('baselines', {})[session.metric_mode] = baselines
+    configure_decisions(session)
+
+def calibration_thread(session):
+    # The data thread feeds clean EMAs into session.baseline_stats while
+    # is_calibrating is set; this thread only runs the countdown.
+    session.baseline_stats.reset()
+    session.is_calibrating = True
+    calibration_seconds = 10
+    for countdown in range(calibration_seconds, 0, -1):
+        session.emit('calibration_status', {'status': 'calibrating', 'countdown': countdown})
+        time.sleep(1.0)
+        if not session.is_streaming:
+            break
+    session.is_calibrating = False
+
+    if not session.baseline_stats.ready(MIN_BASELINE_SAMPLES):
+        session.emit('log_message', 'Calibration failed: not enough clean data. Please try again.')
+        session.emit('calibration_status', {'status': 'failed'})
+        return
+    store_baselines(session, session.baseline_stats.baselines())
+    save_profile(session)
+    print(f"Calibration complete. Baselines: {session.baselines}")
+    session.emit('calibration_status', {'status': 'complete', 'baselines': session.baselines})
+
+
+# --- SocketIO Event Handlers ---
+@socketio.on('connect')
+def handle_connect():
+    client_sessions[request.sid] = DEFAULT_SESSION
+    join_room(DEFAULT_SESSION)
+    get_session(DEFAULT_SESSION).telemetry.add_client(request.sid)
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    session = current_session()
+    session.telemetry.remove_client(request.sid)
+    client_sessions.pop(request.sid, None)
+
+@socketio.on('join_session')
+def handle_join_session(data):
+    session_id = str(data.get('session') or DEFAULT_SESSION).strip() or DEFAULT_SESSION
+    old_session = current_session()
+    if old_session.session_id != session_id:
+        client = old_session.telemetry.remove_client(request.sid) or {}
+        leave_room(old_session.session_id)
+        client_sessions[request.sid] = session_id
+        join_room(session_id)
+        get_session(session_id).telemetry.add_client(request.sid, fps=1.0 / client.get('interval', 0.1),
+                                                     band_powers=client.get('band_powers', False))
+    session = get_session(session_id)
+    emit('connection_status', {'status': session.connection_state})
+    emit('log_message', f"Joined session '{session_id}'.")
+
+@socketio.on('set_profiling')
+def handle_set_profiling(data):
+    session = current_session()
+    enabled = bool(data.get('enabled'))
+    if enabled and not session.stage_timers.enabled:
+        session.stage_timers.reset()
+    session.stage_timers.enabled = enabled
+    emit('log_message', f"Stage timing {'enabled' if enabled else 'disabled'}.")
+
+@socketio.on('telemetry_config')
+def handle_telemetry_config(data):
+    current_session().telemetry.configure(request.sid, fps=data.get('fps'), band_powers=data.get('band_powers'))
+
+@socketio.on('start_stream')
+def handle_start_stream(data):
+    session = current_session()
+    with session.lifecycle_lock:
+        if session.lifecycle_thread is not None or session.connection_state != 'disconnected':
+            emit('log_message', 'Stream is already running.' if session.is_streaming else 'Previous stream is still stopping.')
+            return
+    try:
+        board_id = int(data['board_id'])
+    except (KeyError, ValueError, TypeError):
+        board_id = None
+    if board_id not in BOARD_INDEX:
+        emit('log_message', 'Error: invalid board ID.')
+        return
+    session.board_id = board_id
+    if data.get('execution_mode') in EXECUTION_MODES:
+        session.execution_mode = data['execution_mode']
+    session.params = BrainFlowInputParams()
+    mac_address = data.get('mac_address', '')
+    timeout = data.get('timeout', '20')
+
+    if mac_address: session.params.mac_address = mac_address
+    try:
+        session.params.timeout = int(timeout)
+    except (ValueError, TypeError):
+        session.params.timeout = 20
+
+    session.record_requested = bool(data.get('record'))
+    session.user = str(data.get('user') or session.user).strip() or 'default'
+    session.telemetry.reset()
+    with session.lifecycle_lock:
+        # Re-checked: the handler above may have raced another start_stream
+        if session.lifecycle_thread is not None:
+            return
+        session.stop_event.clear()
+        session.is_streaming = True
+        session.lifecycle_thread = threading.Thread(target=board_lifecycle_thread, args=(session,), daemon=True)
+        session.lifecycle_thread.start()
+
+@socketio.on('start_calibration')
+def handle_start_calibration():
+    session = current_session()
+    if session.connection_state == 'streaming' and not session.is_calibrating:
+        threading.Thread(target=calibration_thread, args=(session,), daemon=True).start()
+
+@socketio.on('stop_stream')
+def handle_stop_stream():
+    session = current_session()
+    with session.lifecycle_lock:
+        if session.lifecycle_thread is None:
+            set_connection_state(session, 'disconnected')
+            return
+        if not session.is_streaming:
+            return  # already stopping
+        # The lifecycle thread notices, leaves the data loop and releases the board
+        set_connection_state(session, 'stopping')
+        session.is_streaming = False
+        session.stop_event.set()
+
+@socketio.on('define_metric')
+def handle_define_metric(data):
+    # e.g. {name: 'frontal_theta', expression: 'theta / (alpha + beta)', aggregation: 'median'}
+    try:
+        metric = Metric(str(data['name']), str(data['expression']), data.get('label'), data.get('aggregation', 'mean'))
+    except (KeyError, SyntaxError, ValueError, TypeError) as e:
+        emit('log_message', f"Invalid metric: {e}")
+        return
+    # The registry is shared by every session, so a name is never redefined
+    if METRICS.setdefault(metric.name, metric) is not metric:
+        emit('log_message', f"Invalid metric: '{metric.name}' is already defined.")
+        return
+    socketio.emit('metric_defined', metric.spec)
+    emit('log_message', f"Metric '{metric.name}' defined as {metric.expression}.")
+
+@socketio.on('update_settings')
+def handle_update_settings(data):
+    session = current_session()
+    print(f"Updating settings: {data}")
+    session.sensitivity = float(data.get('sensitivity', session.sensitivity))
+    if 'key_bindings' in data:
+        session.key_bindings = data['key_bindings']
+        compiled_bindings = {}
+        for state, key_str in session.key_bindings.items():
+            key_str = (key_str or '').lower().strip()
+            if not key_str: continue
+            try:
+                compiled_bindings[state] = (key_str, compile_key_binding(key_str))
+            except ValueError as e:
+                emit('log_message', f"Invalid key binding '{key_str}' for {state}: {e}")
+        session.compiled_bindings = compiled_bindings
+    if 'metric_mode' in data:
+        if data['metric_mode'] in METRICS:
+            changed = data['metric_mode'] != session.metric_mode
+            session.metric_mode = data['metric_mode']
+            # Baselines belong to a metric; switch to the profile's baselines for the new one
+            if changed and session.montage and not apply_profile(session):
+                emit('log_message', f"No calibration saved for {session.metric_mode}. Please calibrate.")
+        else:
+            emit('log_message', f"Unknown metric '{data['metric_mode']}'.")
+    session.smoothing_factor = float(data.get('smoothing', session.smoothing_factor))
+    if data.get('scheduler_policy') in TickScheduler.POLICIES:
+        session.scheduler_policy = data['scheduler_policy']
+        if session.scheduler: session.scheduler.policy = session.scheduler_policy
+    if 'montage' in data:
+        # 'hemispheres', 'lobes' or {region: [channel names]}; applied on the next connect
+        try:
+            session.montage_layout = parse_montage_layout(data['montage'])
+        except ValueError as e:
+            emit('log_message', f"Invalid montage: {e}")
+    if 'filters' in data:
+        # Picked up by the pipeline on the next connect; Nyquist is checked
+        # against the last board used, and again when the next one connects
+        sampling_rate = board_info(session.board_id)['sampling_rate'] if session.board_id in BOARD_INDEX else None
+        try:
+            session.filters = parse_filter_settings(data['filters'], session.filters, sampling_rate)
+        except (AttributeError, TypeError, ValueError) as e:
+            emit('log_message', f"Invalid filters: {e}")
+    if 'adaptive_baseline' in data:
+        session.adaptive_baseline = bool(data['adaptive_baseline'])
+    if 'decision' in data:
+        # Defaults for every state: hysteresis (fraction below the on threshold), dwell_s, refractory_s, action
+        try:
+            session.decision = parse_decision_settings(data['decision'], session.decision)
+        except (AttributeError, TypeError, ValueError) as e:
+            emit('log_message', f"Invalid decision settings: {e}")
+    if 'thresholds' in data:
+        # Per-state overrides, e.g. {'left': {'sensitivity': 1.5, 'action': 'hold'}}; null clears a state
+        try:
+            for state, overrides in data['thresholds'].items():
+                if overrides: session.state_settings[state] = parse_decision_settings(overrides, {}, allow_sensitivity=True)
+                else: session.state_settings.pop(state, None)
+        except (AttributeError, TypeError, ValueError) as e:
+            emit('log_message', f"Invalid thresholds: {e}")
+    configure_decisions(session)
+    emit('log_message', "Settings updated.")
+
+# Rendered once at startup; '/' serves the bytes and answers revalidation with 304
+INDEX_PAGE = render_index_page().encode('utf-8')
+INDEX_ETAG = hashlib.sha1(INDEX_PAGE).hexdigest()
+
+@app.route('/')
+def index():
+    response = Response(INDEX_PAGE, mimetype='text/html')
+    response.set_etag(INDEX_ETAG)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/metrics')
+def metrics():
+    with sessions_lock:
+        current_sessions = dict(sessions)
+    return jsonify({'sessions': {
+        session_id: {
+            'streaming': session.is_streaming,
+            'connection_state': session.connection_state,
+            'board_id': session.board_id,
+            'scheduler': session.scheduler.stats() if session.scheduler else None,
+            'buffers': session.buffer_stats,
+            'stages': session.stage_timers.stats(),
+            'decisions': session.decision_latency.stats(),
+        } for session_id, session in current_sessions.items()
+    }})
+
+@app.route('/profile')
+def profile():
+    # e.g. /profile?seconds=10&hz=200&session=lab2 or &thread=all
+    seconds = min(max(request.args.get('seconds', 5.0, type=float), 0.1), 60.0)
+    hz = min(max(request.args.get('hz', 100.0, type=float), 1.0), 1000.0)
+    session = sessions.get(request.args.get('session', DEFAULT_SESSION))
+    if request.args.get('thread', 'data') == 'all':
+        thread_ids = None
+    elif session is not None and session.data_thread_id is not None:
+        thread_ids = [session.data_thread_id]
+    else:
+        return Response("Data thread is not running.\n", status=409, mimetype='text/plain')
+    folded = sample_stacks(thread_ids, seconds, 1.0 / hz)
+    return Response(folded, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename=profile-{time.strftime("%Y%m%d-%H%M%S")}.folded'})
+
+if __name__ == '__main__':
+    try:
+        import flask, flask_socketio, pynput, numpy, brainflow
+    except ImportError:
+        print("Missing dependencies. Please run: pip install Flask Flask-SocketIO pynput numpy brainflow")
+        sys.exit(1)
+
+    print("Starting BrainFlow BCI Server...")
+    webbrowser.open_new_tab('http://127.0.0.1:5000')
+    socketio.run(app, host='127.0.0.1', port=5000)
+
@@ -0,0 +1,66 @@
+import argparse
+import os
+
+from bci_pipeline import DECISION_ACTIONS, METRICS, RECORDINGS_DIR, replay_recording
+
+# --- Session Replay ---
+# Feeds a recorded session back through the processing pipeline, faster than
+# real time, to reproduce mis-triggers and tune thresholds.
+#
+#   py replay.py recordings/20250101-120000_board41_default
+#   py replay.py recordings/20250101-120000_board41_default --sensitivity 1.5,2,2.5,3
+#   py replay.py recordings/20250101-120000_board41_default --baseline left=1.2 --baseline midline=0.8
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded BrainFlow Keyboard Control session.')
+    parser.add_argument('recording', nargs='?', help=f'recording directory (default: newest in {RECORDINGS_DIR})')
+    parser.add_argument('--metric-mode', choices=list(METRICS), help='defaults to the recorded setting')
+    parser.add_argument('--smoothing', type=float, help='defaults to the recorded setting')
+    parser.add_argument('--sensitivity', help='one value or a comma-separated sweep; defaults to the recorded setting')
+    parser.add_argument('--baseline', action='append', default=[], metavar='REGION=VALUE',
+                        help="override one region's recorded baseline with a multiplier; repeatable")
+    parser.add_argument('--cooldown', type=float, help='refractory period in seconds; defaults to the recorded setting')
+    parser.add_argument('--dwell', type=float, help='seconds a state must stay above threshold before it fires')
+    parser.add_argument('--hysteresis', type=float, help='fraction below the threshold at which a state releases')
+    parser.add_argument('--action', choices=DECISION_ACTIONS)
+    parser.add_argument('--speed', type=float, help='replay at this multiple of real time instead of as fast as possible')
+    parser.add_argument('--list', action='store_true', help='print every trigger')
+    args = parser.parse_args()
+
+    path = args.recording
+    if path is None:
+        sessions = sorted(os.listdir(RECORDINGS_DIR)) if os.path.isdir(RECORDINGS_DIR) else []
+        if not sessions:
+            parser.error(f"No recordings found in {RECORDINGS_DIR}")
+        path = os.path.join(RECORDINGS_DIR, sessions[-1])
+
+    baselines = {}
+    for override in args.baseline:
+        region, _, value = override.partition('=')
+        try:
+            if not region.strip(): raise ValueError
+            baselines[region.strip()] = float(value)
+        except ValueError:
+            parser.error(f"--baseline expects REGION=VALUE, got '{override}'")
+    sensitivities = [float(v) for v in args.sensitivity.split(',')] if args.sensitivity else [None]
+    decision = {key: value for key, value in [('dwell_s', args.dwell), ('hysteresis', args.hysteresis), ('action', args.action)]
+                if value is not None}
+
+    print(f"Replaying {path}")
+    for sensitivity in sensitivities:
+        result = replay_recording(path, metric_mode=args.metric_mode, smoothing_factor=args.smoothing,
+                                  sensitivity=sensitivity, baselines=baselines, cooldown_s=args.cooldown, speed=args.speed,
+                                  decision=decision)
+        counts = {}
+        for _, state in result['triggers']:
+            counts[state] = counts.get(state, 0) + 1
+        label = 'recorded' if sensitivity is None else f"{sensitivity:g}"
+        print(f"sensitivity={label:<8} triggers={len(result['triggers']):<4} {counts} "
+              f"(recorded session: {len(result['recorded_triggers'])}) "
+              f"{result['duration_seconds']:.0f} s replayed in {result['elapsed_seconds']:.2f} s (x{result['speedup']:.0f})")
+        if args.list:
+            for timestamp, state in result['triggers']:
+                print(f"  {timestamp:.3f} {state}")
+
+if __name__ == '__main__':
+    main()